@@ -0,0 +1,211 @@
+"""Solve many puzzles at once, on every core
+
+    python batch.py [options] [file ...]
+
+Files are in the grids.py format, the line format (see formats.py) or
+binary corpus files (see corpus.py), stdin is read when no file is given
+(or for "-"). One line is written per puzzle, as soon as it is solved:
+
+    name <TAB> solved|unsolvable|error <TAB> seconds <TAB> nodes <TAB> backtracks <TAB> values
+
+values are the cell values row by row (comma separated when the grid is
+bigger than 9x9), or the error message. A puzzle that can't be read is an
+error too, named after its file and line ("puzzles.txt:12"), and the
+next ones are still solved.
+
+A puzzle whose result isn't there after --timeout seconds (60 by default)
+is an error too, "timed out": its worker may have died, or it is just
+too slow, and the next ones are still solved.
+
+With --stats FILE, the counters of each solve (see stats.py) are also
+written to FILE, as one JSON object per line.
+"""
+from collections import deque
+from Queue import Queue, Empty
+import json
+import multiprocessing
+import optparse
+import sys
+import time
+
+import corpus
+import formats
+import main
+import stats
+
+def init_worker(combinations_file):
+    if combinations_file:
+        main.load_combinations(combinations_file)
+
+def solve_puzzle(puzzle, with_stats=False, sudoku_engine="search"):
+    """Solve one (name, size, info) puzzle, in a worker
+
+    Returns (name, status, seconds, nodes, backtracks, values, stats),
+    stats being the Stats.as_dict() of the solve if with_stats, else None.
+    Sudokus are solved with sudoku_engine (see Grid.solve)."""
+    name, size, info = puzzle
+    start = time.time()
+    try:
+        g = main.make_grid(size, info)
+        if with_stats:
+            g.stats = stats.Stats()
+        solved = g.solve(sudoku_engine if main.is_sudoku(size) else "search")
+    except Exception as e:
+        return (name, 'error', time.time()-start, 0, 0, "%s: %s" % (e.__class__.__name__, e), None)
+    seconds = time.time()-start
+
+    if solved is None:
+        values = None
+        status = 'unsolvable'
+    else:
+        values = [g.at(x, y).value for y in range(g.size) for x in range(g.size)]
+        status = 'solved'
+    solve_stats = g.stats.as_dict() if with_stats else None
+    return (name, status, seconds, g.search_stats['nodes'], g.search_stats['backtracks'], values,
+            solve_stats)
+
+class ReadError(object):
+    """Stands for a puzzle that couldn't be read, in the puzzles of solve_all
+
+    Its result is the error, like an AsyncResult that is already there."""
+    def __init__(self, name, error):
+        self.result = (name, 'error', 0.0, 0, 0, "%s: %s" % (error.__class__.__name__, error), None)
+
+    def get(self, timeout=None):
+        return self.result
+
+def timed_out(name, timeout):
+    """The error result of a puzzle whose result isn't there after timeout seconds"""
+    return (name, 'error', timeout, 0, 0, "timed out: no result after %g seconds" % (timeout,), None)
+
+def solve_all(puzzles, processes=None, ordered=True, max_in_flight=None,
+                combinations_file=None, with_stats=False, sudoku_engine="search", timeout=None):
+    """Yield the results of solve_puzzle for every puzzle
+
+    At most max_in_flight puzzles are read ahead of the results (4 per
+    process by default), so memory does not grow with the input. Results
+    come in input order if ordered, else as soon as they are ready.
+    ReadError puzzles give their error as their result.
+
+    With a timeout, a result that isn't there after timeout seconds of
+    waiting (a worker that died loses its puzzle) gives timed_out instead:
+    in order, the first pending puzzle; else, every puzzle in flight, as
+    none came back in that time. A result coming after that is dropped."""
+    processes = processes or multiprocessing.cpu_count()
+    max_in_flight = max_in_flight or 4*processes
+    pool = multiprocessing.Pool(processes, init_worker, (combinations_file,))
+    try:
+        if ordered:
+            pending = deque()
+            def next_result():
+                name, result = pending.popleft()
+                try:
+                    return result.get(timeout)
+                except multiprocessing.TimeoutError:
+                    return timed_out(name, timeout)
+            for puzzle in puzzles:
+                if isinstance(puzzle, ReadError):
+                    pending.append((puzzle.result[0], puzzle))
+                else:
+                    pending.append((puzzle[0], pool.apply_async(solve_puzzle,
+                                                    (puzzle, with_stats, sudoku_engine))))
+                if len(pending) >= max_in_flight:
+                    yield next_result()
+            while pending:
+                yield next_result()
+        else:
+            # results come back as (key, result), key standing for the
+            # puzzle in in_flight until its result (or timed_out) is given
+            done = Queue()
+            in_flight = {}
+            def next_results():
+                try:
+                    key, result = done.get(timeout=timeout)
+                except Empty:
+                    lost = [timed_out(in_flight[key], timeout) for key in sorted(in_flight)]
+                    in_flight.clear()
+                    return lost
+                if in_flight.pop(key, None) is None:
+                    return []
+                return [result]
+            for key, puzzle in enumerate(puzzles):
+                if isinstance(puzzle, ReadError):
+                    in_flight[key] = puzzle.result[0]
+                    done.put((key, puzzle.result))
+                else:
+                    in_flight[key] = puzzle[0]
+                    pool.apply_async(solve_puzzle, (puzzle, with_stats, sudoku_engine),
+                                        callback=lambda result, key=key: done.put((key, result)))
+                while len(in_flight) >= max_in_flight:
+                    for result in next_results():
+                        yield result
+            while in_flight:
+                for result in next_results():
+                    yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def format_result(result):
+    name, status, seconds, nodes, backtracks, values, solve_stats = result
+    if isinstance(values, list):
+        sep = "," if max(values) > 9 else ""
+        values = sep.join(str(v) for v in values)
+    return "\t".join([name, status, "%.6f" % (seconds,), str(nodes), str(backtracks), values or ""])
+
+def read_puzzles(paths):
+    """Yield the puzzles of the files, and a ReadError for each one that can't be read"""
+    for path in paths or ['-']:
+        def on_error(number, error, path=path):
+            return ReadError("%s:%d" % (path, number), error)
+        if path == '-':
+            for puzzle in formats.read(sys.stdin, on_error):
+                yield puzzle
+        elif corpus.is_corpus(path):
+            puzzles = corpus.Corpus(path)
+            for puzzle in puzzles:
+                yield puzzle
+            puzzles.close()
+        else:
+            with open(path) as f:
+                for puzzle in formats.read(f, on_error):
+                    yield puzzle
+
+def readable(puzzles):
+    """The puzzles of read_puzzles that could be read, the errors go to stderr"""
+    for puzzle in puzzles:
+        if isinstance(puzzle, ReadError):
+            print >>sys.stderr, format_result(puzzle.result)
+        else:
+            yield puzzle
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options] [file ...]")
+    parser.add_option("-j", "--processes", type="int", default=None,
+                        help="number of worker processes (default: one per core)")
+    parser.add_option("-u", "--unordered", action="store_true", default=False,
+                        help="write results as soon as they are ready, not in input order")
+    parser.add_option("-m", "--max-in-flight", type="int", default=None,
+                        help="puzzles read ahead of the results (default: 4 per process)")
+    parser.add_option("-c", "--combinations", default=None,
+                        help="combination tables file (see main.save_combinations)")
+    parser.add_option("-s", "--stats", default=None,
+                        help="write the counters of each solve to this file (JSON lines)")
+    parser.add_option("-e", "--sudoku-engine", choices=["search", "dlx"], default="search",
+                        help="how sudokus are solved: search (default) or dlx (exact cover)")
+    parser.add_option("-t", "--timeout", type="float", default=60,
+                        help="seconds to wait for a result before it is a \"timed out\" error (default: 60)")
+    options, paths = parser.parse_args()
+
+    stats_file = open(options.stats, 'w') if options.stats else None
+    results = solve_all(read_puzzles(paths), options.processes, not options.unordered,
+                        options.max_in_flight, options.combinations, stats_file is not None,
+                        options.sudoku_engine, options.timeout)
+    for result in results:
+        print format_result(result)
+        sys.stdout.flush()
+        if stats_file is not None and result[6] is not None:
+            stats_file.write(json.dumps(dict(result[6], name=result[0]), sort_keys=True) + "\n")
+    if stats_file is not None:
+        stats_file.close()
@@ -0,0 +1,169 @@
+"""Benchmark the solver
+
+    python bench.py [options]
+
+Puzzles are grouped in classes: the grids of grids.py by kind and size
+(grids-mathdoku7, grids-sudoku, ...) and generated ones
+(generated-sudoku, generated-sudoku16, generated-sudoku25,
+generated-mathdoku4 to generated-mathdoku9, with a fixed seed so that every
+run solves the same puzzles).
+
+For each class, it reports the median and 95th percentile solve time,
+the median number of propagation steps (conditions processed) and search
+nodes, and the peak memory of the process that solved it (each class is
+solved in a fresh process).
+
+--save FILE writes the results as a JSON baseline. --baseline FILE compares
+with a saved baseline, and exits with status 1 if a class got slower (or
+needs more steps) by more than --threshold (0.25 = 25% by default). The
+baseline has to be made with the same --count and --seed (the generated
+puzzles would not be the same otherwise), --repeat and --sudoku-engine.
+"""
+from collections import OrderedDict
+import json
+import multiprocessing
+import optparse
+import random
+import resource
+import sys
+import time
+
+import generator
+import main
+import stats
+
+def corpus_classes():
+    from grids import all_grids
+    classes = {}
+    for name in sorted(all_grids):
+        size, info = all_grids[name]
+        kind = "grids-%s" % (size,) if main.is_sudoku(size) else "grids-mathdoku%d" % (size,)
+        classes.setdefault(kind, []).append((name, size, info))
+    return OrderedDict(sorted(classes.items()))
+
+def generated_classes(count, seed):
+    rng = random.Random(seed)
+    classes = OrderedDict()
+    classes["generated-sudoku"] = [generator.sudoku_puzzle(rng, 25) for i in range(count)]
+    classes["generated-sudoku16"] = [generator.sudoku_puzzle(rng, 120, box=4) for i in range(count)]
+    classes["generated-sudoku25"] = [generator.sudoku_puzzle(rng, 375, box=5) for i in range(count)]
+    for size in range(4, 10):
+        classes["generated-mathdoku%d" % (size,)] = [generator.mathdoku_puzzle(size, rng)
+                                                        for i in range(count)]
+    return classes
+
+def solve_one(puzzle, repeat, sudoku_engine="search"):
+    """(best time, propagation steps, search nodes, solved) of a puzzle"""
+    name, size, info = puzzle
+    best = None
+    for i in range(repeat):
+        g = main.make_grid(size, info)
+        g.stats = stats.Stats()
+        start = time.time()
+        solved = g.solve(sudoku_engine if main.is_sudoku(size) else "search") is not None
+        seconds = time.time() - start
+        best = seconds if best is None else min(best, seconds)
+    steps = sum(counters['calls'] for counters in g.stats.conditions.itervalues())
+    return best, steps, g.search_stats['nodes'], solved
+
+def percentile(values, p):
+    """Nearest-rank percentile (p between 0 and 100)"""
+    values = sorted(values)
+    rank = max(1, int(round(p / 100.0 * len(values))))
+    return values[rank-1]
+
+def run_class(puzzles, repeat, sudoku_engine="search"):
+    """Solve a class of puzzles (in its own process), and summarize it"""
+    results = [solve_one(puzzle, repeat, sudoku_engine) for puzzle in puzzles]
+    times = [r[0] for r in results]
+    return {
+        'puzzles': len(results),
+        'unsolved': sum(1 for r in results if not r[3]),
+        'time_median': percentile(times, 50),
+        'time_p95': percentile(times, 95),
+        'steps_median': percentile([r[1] for r in results], 50),
+        'nodes_median': percentile([r[2] for r in results], 50),
+        'peak_memory_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+def run(classes, repeat=1, sudoku_engine="search"):
+    results = OrderedDict()
+    for name, puzzles in classes.iteritems():
+        pool = multiprocessing.Pool(1)
+        try:
+            results[name] = pool.apply(run_class, (puzzles, repeat, sudoku_engine))
+        finally:
+            pool.terminate()
+            pool.join()
+    return results
+
+# what is compared with the baseline (bigger is worse)
+COMPARED = ('time_median', 'time_p95', 'steps_median')
+
+def regressions(results, baseline, threshold):
+    """(class, measure, old, new) for everything worse than the baseline by more than threshold"""
+    found = []
+    for name, result in results.iteritems():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        for measure in COMPARED:
+            if result[measure] > old[measure] * (1 + threshold):
+                found.append((name, measure, old[measure], result[measure]))
+    return found
+
+def report(results):
+    print "%-22s %5s %10s %10s %7s %7s %9s" % ("class", "n", "median s", "p95 s", "steps", "nodes", "peak kB")
+    for name, r in results.iteritems():
+        print "%-22s %5d %10.4f %10.4f %7d %7d %9d" % (name, r['puzzles'], r['time_median'],
+                r['time_p95'], r['steps_median'], r['nodes_median'], r['peak_memory_kb']),
+        print "(%d unsolved)" % (r['unsolved'],) if r['unsolved'] else ""
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-n", "--count", type="int", default=20,
+                        help="generated puzzles per class (default: 20)")
+    parser.add_option("--seed", type="int", default=0,
+                        help="seed of the generated puzzles (default: 0)")
+    parser.add_option("-r", "--repeat", type="int", default=1,
+                        help="solve each puzzle this many times, keep the best time")
+    parser.add_option("-e", "--sudoku-engine", choices=["search", "dlx"], default="search",
+                        help="how sudokus are solved: search (default) or dlx (exact cover)")
+    parser.add_option("-k", "--classes", default=None,
+                        help="only run the classes starting with one of these (comma separated)")
+    parser.add_option("--save", default=None, help="write the results to this JSON file")
+    parser.add_option("--baseline", default=None, help="compare with this JSON file")
+    parser.add_option("-t", "--threshold", type="float", default=0.25,
+                        help="allowed regression over the baseline (default: 0.25)")
+    options, args = parser.parse_args()
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        for option in ('count', 'seed', 'repeat', 'sudoku_engine'):
+            if baseline.get(option) != getattr(options, option):
+                parser.error("%s was made with --%s %s, not %s: the timings can't be compared"
+                                % (options.baseline, option.replace('_', '-'), baseline.get(option),
+                                    getattr(options, option)))
+
+    classes = corpus_classes()
+    classes.update(generated_classes(options.count, options.seed))
+    if options.classes:
+        prefixes = tuple(options.classes.split(","))
+        classes = OrderedDict((k, v) for k, v in classes.iteritems() if k.startswith(prefixes))
+
+    results = run(classes, options.repeat, options.sudoku_engine)
+    report(results)
+
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump({'count': options.count, 'seed': options.seed, 'repeat': options.repeat,
+                        'sudoku_engine': options.sudoku_engine, 'classes': results},
+                        f, indent=1, sort_keys=True)
+
+    if options.baseline:
+        found = regressions(results, baseline['classes'], options.threshold)
+        for name, measure, old, new in found:
+            print "REGRESSION %s %s: %s -> %s" % (name, measure, old, new)
+        if found:
+            sys.exit(1)
@@ -0,0 +1,284 @@
+"""Canonical form of puzzles
+
+Equivalent puzzles have the same solutions, up to a transform: a sudoku
+can be rotated or reflected, its bands, its stacks, the rows of a band and
+the columns of a stack can be swapped, and its digits relabeled. A mathdoku
+can be rotated or reflected, and the order of its cages (and of their
+cells) doesn't matter.
+
+canonicalize() gives the same canonical info for equivalent puzzles, and
+the Transform between them, to use the solution of one for the other:
+
+    key, transform = canonical_key(size, info)
+    ... solve the canonical puzzle once per key, keeping its values ...
+    values = transform.from_canonical(canonical_values)
+
+Sudokus made of givens only get the smallest form of all: the smallest
+pattern of givens (rows of blank or given cells), then the smallest digits
+(relabeled in order of appearance). The search for it is bounded: when
+too many forms are alike (almost no givens, or almost only givens), and
+for every other puzzle, only rotations and reflections are tried. Either
+way, the canonical info is a puzzle equivalent to the original one, so
+two puzzles with the same canonical info are always equivalent.
+"""
+from itertools import groupby, permutations, product
+import hashlib
+
+import main
+
+# how much of the search for the smallest sudoku is done before giving up
+SEARCH_NODES_MAX = 2000
+ARRANGEMENTS_MAX = 2000
+
+class TooManyForms(Exception):
+    pass
+
+class Transform(object):
+    """How the cells and values of a canonical grid map to the original grid
+
+    cells maps each canonical (x, y) to the original one, digits each
+    canonical value to the original one (None: values are the same)."""
+    def __init__(self, size, cells, digits=None):
+        self.size = size
+        self.cells = cells
+        self.digits = digits
+
+    def from_canonical(self, values):
+        """Values of the original grid (row by row, as batch.py writes them) from the canonical ones"""
+        n = self.size
+        original = [None]*(n*n)
+        for (x, y), (ox, oy) in self.cells.iteritems():
+            v = values[y*n + x]
+            if v is not None and self.digits is not None:
+                v = self.digits[v]
+            original[oy*n + ox] = v
+        return original
+
+    def to_canonical(self, values):
+        """Values of the canonical grid (row by row) from the original ones"""
+        n = self.size
+        labels = dict((v, label) for label, v in self.digits.iteritems()) if self.digits else None
+        canonical = [None]*(n*n)
+        for (x, y), (ox, oy) in self.cells.iteritems():
+            v = values[oy*n + ox]
+            if v is not None and labels is not None:
+                v = labels[v]
+            canonical[y*n + x] = v
+        return canonical
+
+def canonical_key(size, info):
+    """(hash of the canonical form, Transform to it) of a puzzle
+
+    The key doesn't depend on how the puzzle was read (JSON gives unicode
+    strings, the text formats str ones):
+
+    >>> canonical_key(4, [[u"3=", (1, 0)]])[0] == canonical_key(4, [["3=", (1, 0)]])[0]
+    True
+    """
+    canonical, transform = canonicalize(size, info)
+    return hashlib.sha1(repr((str(size), canonical))).hexdigest(), transform
+
+def canonicalize(size, info):
+    """(canonical info, Transform) of a puzzle, info being as in grids.py"""
+    n, box = main.grid_dimensions(size)
+    givens = sudoku_givens(info) if box else None
+    if givens is not None:
+        try:
+            return smallest_sudoku(n, box, givens)
+        except TooManyForms:
+            pass
+    return smallest_rotation(n, info)
+
+def sudoku_givens(info):
+    """{(x, y): value} of a sudoku only made of givens (one cell "=" blocks), else None"""
+    givens = {}
+    for blk in info:
+        if len(blk) != 2 or blk[0][-1:] != '=' or tuple(blk[1]) in givens:
+            return None
+        givens[tuple(blk[1])] = int(blk[0][:-1])
+    return givens
+
+def rotations(n):
+    """The 8 rotations and reflections of an n x n grid, as functions of (x, y)"""
+    m = n-1
+    return [lambda x, y: (x, y), lambda x, y: (m-x, y), lambda x, y: (x, m-y),
+            lambda x, y: (m-x, m-y), lambda x, y: (y, x), lambda x, y: (m-y, x),
+            lambda x, y: (y, m-x), lambda x, y: (m-y, m-x)]
+
+def smallest_rotation(n, info):
+    """Canonical info and Transform, with the smallest sorted blocks of every rotation and reflection"""
+    best = None
+    for turn in rotations(n):
+        blocks = sorted(tuple([str(blk[0])] + sorted(turn(*cpos) for cpos in blk[1:])) for blk in info)
+        if best is None or blocks < best[0]:
+            best = blocks, turn
+    blocks, turn = best
+    cells = dict((turn(x, y), (x, y)) for x in range(n) for y in range(n))
+    return [list(blk) for blk in blocks], Transform(n, cells)
+
+def smallest_sudoku(n, box, givens):
+    """Canonical info and Transform of a sudoku of givens (see the module docstring)
+
+    Raises TooManyForms when the search goes past SEARCH_NODES_MAX or
+    ARRANGEMENTS_MAX."""
+    grid = [[givens.get((x, y), 0) for x in range(n)] for y in range(n)]
+    transposed = [list(col) for col in zip(*grid)]
+
+    # the smallest pattern, in either orientation
+    found = []
+    for flipped, rows in ((False, grid), (True, transposed)):
+        patterns, leaves = smallest_patterns(rows, box)
+        found.append((patterns, flipped, rows, leaves))
+    smallest = min(patterns for patterns, flipped, rows, leaves in found)
+
+    # the smallest digits of the forms with that pattern
+    candidates = []
+    for patterns, flipped, rows, leaves in found:
+        if patterns != smallest:
+            continue
+        for order, structure in leaves:
+            orders, count = column_orders(structure, rows)
+            candidates.append((flipped, rows, order, orders, count))
+    if sum(candidate[-1] for candidate in candidates) > ARRANGEMENTS_MAX:
+        raise TooManyForms()
+
+    best = None
+    for flipped, rows, order, orders, count in candidates:
+        for columns in orders:
+            values, labels = relabel(rows, order, columns)
+            if best is None or values < best[0]:
+                best = values, labels, flipped, order, columns
+    values, labels, flipped, order, columns = best
+
+    info = [["%d=" % (v,), (x, y)] for y in range(n) for x, v in enumerate(values[y*n:(y+1)*n]) if v]
+    if flipped:
+        cells = dict(((x, y), (r, c)) for y, r in enumerate(order) for x, c in enumerate(columns))
+    else:
+        cells = dict(((x, y), (c, r)) for y, r in enumerate(order) for x, c in enumerate(columns))
+    digits = dict((label, v) for v, label in labels.iteritems())
+    # digits that are not given take the labels that are left
+    missing = [v for v in range(1, n+1) if v not in labels]
+    digits.update(zip(range(len(labels)+1, n+1), missing))
+    return info, Transform(n, cells, digits)
+
+def refine(structure, row):
+    """(pattern of row, refined structure) with the smallest pattern structure allows
+
+    A structure is an ordering of the columns, in which some of them are
+    still interchangeable: a tuple of classes of stacks that are alike so
+    far (in any order), each stack being a tuple of cells of columns that
+    are alike so far. The pattern of row is the tuple of 0 (blank) and 1
+    (given) of its cells, with blanks first in every cell, and the stacks of
+    each class sorted."""
+    pattern = []
+    classes = []
+    for cls in structure:
+        stacks = []
+        for stack in cls:
+            cells = []
+            stack_pattern = []
+            for cell in stack:
+                for bit in (0, 1):
+                    part = tuple(c for c in cell if bool(row[c]) == bit)
+                    if part:
+                        cells.append(part)
+                        stack_pattern.extend([bit]*len(part))
+            stacks.append((tuple(stack_pattern), tuple(cells)))
+        stacks.sort()
+        for stack_pattern, alike in groupby(stacks, key=lambda stack: stack[0]):
+            alike = tuple(cells for p, cells in alike)
+            classes.append(alike)
+            pattern.extend(stack_pattern*len(alike))
+    return tuple(pattern), tuple(classes)
+
+def smallest_patterns(rows, box):
+    """(smallest patterns, leaves) of the rows of a grid, under the permutations of its bands and stacks
+
+    Rows are chosen one at a time, the one with the smallest pattern
+    among those that can come next (trying each of them when they are
+    alike). leaves are the (row order, structure) with the smallest
+    patterns."""
+    n = box*box
+    start = (tuple((tuple(range(s*box, (s+1)*box)),) for s in range(box)),)
+    best = []
+    leaves = []
+    nodes = [0]
+
+    def visit(order, structure):
+        nodes[0] += 1
+        if nodes[0] > SEARCH_NODES_MAX:
+            raise TooManyForms()
+        k = len(order)
+        if k == n:
+            leaves.append((order, structure))
+            return
+        if k % box == 0:
+            bands = set(r // box for r in order)
+            choices = [r for r in range(n) if r // box not in bands]
+        else:
+            band = order[k - k % box] // box
+            choices = [r for r in range(band*box, (band+1)*box) if r not in order]
+        refined = [(refine(structure, rows[r]), r) for r in choices]
+        smallest = min(pattern for (pattern, s), r in refined)
+        if k < len(best):
+            if smallest > best[k]:
+                return
+            if smallest < best[k]:
+                del best[k:]
+                del leaves[:]
+        if k == len(best):
+            best.append(smallest)
+        for (pattern, s), r in refined:
+            if pattern == smallest:
+                visit(order + [r], s)
+
+    visit([], start)
+    return best, leaves
+
+def column_orders(structure, rows):
+    """(column orders, how many) that structure still allows
+
+    Columns or stacks without any given are left where they are: their
+    order doesn't change anything."""
+    blank = set(c for c in range(len(rows)) if not any(row[c] for row in rows))
+
+    def cell_orders(cell):
+        if len(cell) == 1 or cell[0] in blank:
+            return [cell]
+        return list(permutations(cell))
+
+    def stack_orders(stack):
+        return [sum(cells, ()) for cells in product(*[cell_orders(cell) for cell in stack])]
+
+    class_orders = []
+    count = 1
+    for cls in structure:
+        stacks = [stack_orders(stack) for stack in cls]
+        if len(cls) == 1 or all(c in blank for cell in cls[0] for c in cell):
+            turns = [range(len(cls))]
+        else:
+            turns = list(permutations(range(len(cls))))
+        class_orders.append((turns, stacks))
+        count *= len(turns) * reduce(lambda a, b: a*b, [len(s) for s in stacks], 1)
+
+    def orders():
+        for choice in product(*[class_order(turns, stacks) for turns, stacks in class_orders]):
+            yield sum(choice, ())
+
+    def class_order(turns, stacks):
+        return [sum(picked, ()) for turn in turns for picked in product(*[stacks[i] for i in turn])]
+
+    return orders(), count
+
+def relabel(rows, order, columns):
+    """(values row by row, labels) of a grid read in that order, digits relabeled by first appearance"""
+    labels = {}
+    values = []
+    for r in order:
+        row = rows[r]
+        for c in columns:
+            v = row[c]
+            if v:
+                v = labels.setdefault(v, len(labels)+1)
+            values.append(v)
+    return tuple(values), labels
@@ -0,0 +1,204 @@
+"""Binary puzzle corpus
+
+    python corpus.py [-o corpus.dok] [file ...]     # write (grids.py when no file)
+    python corpus.py -d corpus.dok                  # read back, in the line format
+
+A compact file for millions of puzzles, read without parsing it all: the
+records are followed by an index of their offsets, and Corpus reads them
+one at a time from a memory map.
+
+    header   "DOKU", version (B), 3 pad bytes, count (I), index offset (Q)
+    records  kind (B), side (B), name length (H), name, then:
+               givens (kind 0, a sudoku of "=" blocks of one cell):
+                 every cell, row by row, side.bit_length() bits each
+                 (0: blank), packed into ceil(side*side*bits/8) bytes
+               blocks (kind 1 sudoku, kind 2 mathdoku):
+                 block count (H), then for each block: operator (c),
+                 value (I), cell count (B) and its cells as y*side+x,
+                 one byte each (two, H, when side*side > 256)
+    index    offset of each record (Q)
+
+Everything is little endian. batch.py reads these files too.
+"""
+import binascii
+import mmap
+import optparse
+import struct
+import sys
+
+import formats
+import main
+
+MAGIC = "DOKU"
+VERSION = 1
+HEADER = struct.Struct("<4sBxxxIQ")
+RECORD = struct.Struct("<BBH")
+BLOCK = struct.Struct("<cIB")
+COUNT = struct.Struct("<H")
+OFFSET = struct.Struct("<Q")
+
+KIND_GIVENS, KIND_SUDOKU, KIND_MATHDOKU = 0, 1, 2
+
+def sudoku_size(side):
+    return 'sudoku' if side == 9 else 'sudoku%d' % (side,)
+
+def givens_length(side):
+    return (side*side*side.bit_length() + 7) // 8
+
+def pack_givens(side, givens):
+    bits = side.bit_length()
+    packed = 0
+    for y in range(side):
+        for x in range(side):
+            packed = packed << bits | givens.get((x, y), 0)
+    length = givens_length(side)
+    packed <<= 8*length - side*side*bits
+    return binascii.unhexlify("%0*x" % (2*length, packed))
+
+# shared by the decoded puzzles: condition of each value, (x, y) of each cell
+GIVENS = ["%d=" % (v,) for v in range(256)]
+POSITIONS = {}
+HEX_DIGITS = dict((d, int(d, 16)) for d in "0123456789abcdef")
+
+def unpack_givens(side, data):
+    bits = side.bit_length()
+    if bits == 4:
+        # one hex digit per cell (9x9)
+        values = map(HEX_DIGITS.__getitem__, binascii.hexlify(data)[:side*side])
+    else:
+        packed = int(binascii.hexlify(data), 16) >> (8*len(data) - side*side*bits)
+        mask = (1 << bits) - 1
+        values = [packed >> (bits*i) & mask for i in range(side*side-1, -1, -1)]
+    try:
+        positions = POSITIONS[side]
+    except KeyError:
+        positions = POSITIONS[side] = [(i % side, i // side) for i in range(side*side)]
+    return [[GIVENS[v], cpos] for v, cpos in zip(values, positions) if v]
+
+def encode(name, size, info):
+    """Record of a (name, size, info) puzzle"""
+    side, box = main.grid_dimensions(size)
+    if not 0 < side < 256:
+        raise ValueError("Can't write a %dx%d grid" % (side, side))
+    if len(name) > 0xffff:
+        raise ValueError("Name too long: %r..." % (name[:20],))
+    givens = None
+    if box:
+        givens = {}
+        for blk in info:
+            if len(blk) != 2 or blk[0][-1:] != '=' or tuple(blk[1]) in givens:
+                givens = None
+                break
+            givens[tuple(blk[1])] = int(blk[0][:-1])
+    if givens is not None and all(0 < v <= side for v in givens.itervalues()):
+        return RECORD.pack(KIND_GIVENS, side, len(name)) + name + pack_givens(side, givens)
+
+    cell = "<H" if side*side > 256 else "<B"
+    parts = [RECORD.pack(KIND_SUDOKU if box else KIND_MATHDOKU, side, len(name)), name,
+                COUNT.pack(len(info))]
+    for blk in info:
+        parts.append(BLOCK.pack(blk[0][-1], int(blk[0][:-1]), len(blk)-1))
+        parts.append(struct.pack(cell[0] + cell[1]*(len(blk)-1), *[y*side + x for x, y in blk[1:]]))
+    return "".join(parts)
+
+def decode(data, offset):
+    """(name, size, info) of the record at offset"""
+    kind, side, name_length = RECORD.unpack_from(data, offset)
+    offset += RECORD.size
+    name = data[offset:offset+name_length]
+    offset += name_length
+    if kind == KIND_GIVENS:
+        return name, sudoku_size(side), unpack_givens(side, data[offset:offset+givens_length(side)])
+
+    cell = "<H" if side*side > 256 else "<B"
+    cell_size = struct.calcsize(cell)
+    count, = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    info = []
+    for i in range(count):
+        op, value, cells = BLOCK.unpack_from(data, offset)
+        offset += BLOCK.size
+        positions = struct.unpack_from(cell[0] + cell[1]*cells, data, offset)
+        offset += cell_size*cells
+        info.append(["%d%s" % (value, op)] + [(p % side, p // side) for p in positions])
+    return name, sudoku_size(side) if kind == KIND_SUDOKU else side, info
+
+def write(f, puzzles):
+    """Write (name, size, info) puzzles to an opened file (binary, seekable), returns their count"""
+    start = f.tell()
+    f.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+    offsets = []
+    position = start + HEADER.size
+    for name, size, info in puzzles:
+        record = encode(name, size, info)
+        offsets.append(position - start)
+        f.write(record)
+        position += len(record)
+    for i in xrange(0, len(offsets), 4096):
+        chunk = offsets[i:i+4096]
+        f.write(struct.pack("<%dQ" % (len(chunk),), *chunk))
+    f.seek(start)
+    f.write(HEADER.pack(MAGIC, VERSION, len(offsets), position - start))
+    f.seek(0, 2)
+    return len(offsets)
+
+def is_corpus(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+class Corpus(object):
+    """Puzzles of a corpus file, read as they are asked for
+
+    corpus[i] is the (name, size, info) of the i-th puzzle, and iterating
+    over it yields them all."""
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self.index = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d corpus" % (path, VERSION))
+
+    def __len__(self):
+        return self.count
+
+    def offset(self, i):
+        return OFFSET.unpack_from(self.data, self.index + OFFSET.size*i)[0]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("corpus index out of range")
+        return decode(self.data, self.offset(i))
+
+    def __iter__(self):
+        for i in xrange(self.count):
+            yield decode(self.data, self.offset(i))
+
+    def close(self):
+        self.data.close()
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options] [file ...]")
+    parser.add_option("-o", "--output", default="corpus.dok",
+                        help="corpus file to write (default: corpus.dok)")
+    parser.add_option("-d", "--dump", action="store_true", default=False,
+                        help="write the puzzles of the given corpus files in the line format")
+    options, paths = parser.parse_args()
+
+    if options.dump:
+        for path in paths:
+            corpus = Corpus(path)
+            for puzzle in corpus:
+                print formats.format_line(*puzzle)
+            corpus.close()
+    else:
+        if paths:
+            import batch
+            puzzles = batch.readable(batch.read_puzzles(paths))
+        else:
+            from grids import all_grids
+            puzzles = ((name, size, info) for name, (size, info) in sorted(all_grids.iteritems()))
+        with open(options.output, 'wb') as f:
+            count = write(f, puzzles)
+        print >>sys.stderr, "%d puzzles written to %s" % (count, options.output)
@@ -0,0 +1,56 @@
+"""Exact cover (Knuth's Algorithm X)
+
+A problem is given by its columns (the constraints) and rows (the
+choices): X maps each column to the set of rows that cover it, and Y maps
+each row to the list of its columns. A solution is a set of rows that
+covers every column exactly once.
+
+Instead of the linked lists of dancing links, columns are dicts of sets
+that are covered and uncovered in place, in the same order: this is the
+fast way to do it in Python.
+
+Grid.exact_cover (main.py) builds the problem of a sudoku.
+"""
+
+def exact_cover(X, Y, search_stats=None):
+    """Yield the solutions (lists of rows) of the problem, X and Y are changed while it runs
+
+    search_stats, if given, is a dict whose 'nodes' and 'backtracks' are counted."""
+    if search_stats is None:
+        search_stats = {'nodes': 0, 'backtracks': 0}
+    return search(X, Y, [], search_stats)
+
+def search(X, Y, partial, search_stats):
+    search_stats['nodes'] += 1
+    if not X:
+        yield list(partial)
+        return
+    # the column with the fewest rows
+    col = min(X, key=lambda c: len(X[c]))
+    for row in list(X[col]):
+        partial.append(row)
+        removed = select(X, Y, row)
+        for solution in search(X, Y, partial, search_stats):
+            yield solution
+        deselect(X, Y, row, removed)
+        partial.pop()
+        search_stats['backtracks'] += 1
+
+def select(X, Y, row):
+    """Cover the columns of row, and remove the rows that share one of them"""
+    removed = []
+    for col in Y[row]:
+        for other in X[col]:
+            for other_col in Y[other]:
+                if other_col != col:
+                    X[other_col].remove(other)
+        removed.append(X.pop(col))
+    return removed
+
+def deselect(X, Y, row, removed):
+    for col in reversed(Y[row]):
+        X[col] = removed.pop()
+        for other in X[col]:
+            for other_col in Y[other]:
+                if other_col != col:
+                    X[other_col].add(other)
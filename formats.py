@@ -0,0 +1,166 @@
+"""Reading and writing puzzle definitions
+
+A puzzle is (name, size, info), like the arguments of add() in grids.py:
+size is the grid size or 'sudoku' ('sudoku16', ... for bigger ones), and info is a list of blocks, each one
+being [condition, (x, y), (x, y), ...].
+
+Three formats are supported:
+
+ * the grids.py format: add(name, size, [...], [...], ...) calls
+   (this is also what input.py prints)
+ * the line format, one puzzle per line:
+       name size condition:x,y:x,y condition:x,y ...
+   e.g. "first 4 8+:0,0:0,1:1,1 3=:1,0 ..."
+   Empty lines and lines starting with # are ignored.
+ * the sudoku line format (the one of most sudoku collections), one 9x9
+   sudoku per line: its 81 cells row by row, "." or "0" for blanks
+       4.....8.5.3..........7......2.....6.....8.4......1.......6.3.7.5..2.....1.4......
+   Anything after the 81 cells (a rating, a comment, ...) is ignored, the
+   puzzles are named after their line number ("line12").
+
+The readers raise ValueError (SyntaxError for grids.py files) on what
+they can't read, unless they are given on_error(line number, exception):
+the puzzle it returns (if not None) is yielded instead, and reading goes
+on with the next line (the next add call for grids.py files).
+"""
+import ast
+
+def format_add(name, size, info):
+    return """add(%s, %s,
+*%s)""" % (repr(name), repr(size), repr(list(info)))
+
+def read_add(text, on_error=None):
+    """Yield the puzzles of the add(...) calls in text (the rest is ignored)
+
+    The arguments are read as literals, nothing in text is executed."""
+    try:
+        body = ast.parse(text).body
+    except SyntaxError as e:
+        if on_error is None:
+            raise
+        puzzle = on_error(e.lineno, e)
+        if puzzle is not None:
+            yield puzzle
+        return
+    for node in body:
+        call = getattr(node, 'value', None)
+        if not isinstance(node, ast.Expr) or not isinstance(call, ast.Call):
+            continue
+        if not isinstance(call.func, ast.Name) or call.func.id != 'add':
+            continue
+        try:
+            args = [ast.literal_eval(arg) for arg in call.args]
+            if call.starargs is not None:
+                args.extend(ast.literal_eval(call.starargs))
+            if len(args) < 2:
+                raise ValueError("add() needs a name and a size")
+            puzzle = args[0], args[1], [list(blk) for blk in args[2:]]
+        except (ValueError, TypeError) as e:
+            if on_error is None:
+                raise
+            puzzle = on_error(node.lineno, e)
+        if puzzle is not None:
+            yield puzzle
+
+def format_line(name, size, info):
+    if len(name.split()) != 1:
+        raise ValueError("Name %r can't be written in the line format" % (name,))
+    blocks = [":".join([blk[0]] + ["%d,%d" % cpos for cpos in blk[1:]]) for blk in info]
+    return " ".join([name, str(size)] + blocks)
+
+def parse_line(line):
+    """Puzzle of a line in the line format (None for empty and comment lines)"""
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    fields = line.split()
+    name, size = fields[0], fields[1]
+    if not size.startswith('sudoku'):
+        size = int(size)
+    info = []
+    for blk in fields[2:]:
+        parts = blk.split(':')
+        info.append([parts[0]] + [tuple(int(i) for i in cpos.split(',')) for cpos in parts[1:]])
+    return name, size, info
+
+SUDOKU_CELLS = 81
+SUDOKU_BLANKS = ".0"
+# what each character of a sudoku line gives, and the position of each cell
+SUDOKU_GIVENS = dict((str(v), "%d=" % (v,)) for v in range(1, 10))
+SUDOKU_POSITIONS = [(i % 9, i // 9) for i in range(SUDOKU_CELLS)]
+
+def is_sudoku_line(line):
+    cells = line[:SUDOKU_CELLS]
+    return (len(cells) == SUDOKU_CELLS and not cells.strip("123456789" + SUDOKU_BLANKS)
+            and line[SUDOKU_CELLS:SUDOKU_CELLS+1].strip() in ('', ','))
+
+def parse_sudoku_line(line, name):
+    """Puzzle of a line in the sudoku line format (None for empty and comment lines)
+
+    Raises ValueError if it isn't one."""
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    if not is_sudoku_line(line):
+        raise ValueError("Not a sudoku line: %r" % (line,))
+    givens = SUDOKU_GIVENS
+    return name, 'sudoku', [[givens[ch], cpos] for ch, cpos in zip(line, SUDOKU_POSITIONS)
+                                if ch in givens]
+
+def read_sudoku_lines(lines, first_number=1, on_error=None):
+    for number, line in enumerate(lines, first_number):
+        try:
+            puzzle = parse_sudoku_line(line, "line%d" % (number,))
+        except ValueError as e:
+            if on_error is None:
+                raise
+            puzzle = on_error(number, e)
+        if puzzle is not None:
+            yield puzzle
+
+def format_sudoku_line(name, size, info):
+    """Sudoku line of a 9x9 sudoku made of givens (the name is not written)"""
+    cells = ["."]*SUDOKU_CELLS
+    for blk in info:
+        if size != 'sudoku' or len(blk) != 2 or blk[0][-1] != '=':
+            raise ValueError("%s can't be written in the sudoku line format" % (name,))
+        x, y = blk[1]
+        cells[y*9 + x] = blk[0][:-1]
+    return "".join(cells)
+
+def read_lines(lines, first_number=1, on_error=None):
+    for number, line in enumerate(lines, first_number):
+        try:
+            puzzle = parse_line(line)
+        except (ValueError, IndexError) as e:
+            if on_error is None:
+                raise
+            puzzle = on_error(number, e)
+        if puzzle is not None:
+            yield puzzle
+
+def read(f, on_error=None):
+    """Yield the puzzles of an opened file, in any of the formats
+
+    Line format files are read as they go, grids.py files are read at once."""
+    # readline, not iteration: stdin has to be read as lines come in
+    head = []
+    for line in iter(f.readline, ''):
+        head.append(line)
+        if line.strip() and not line.lstrip().startswith('#'):
+            break
+
+    fields = head[-1].split() if head else []
+    if fields and (fields[0].startswith('add(') or fields[0] in ('def', 'all_grids', 'add')):
+        for puzzle in read_add("".join(head) + f.read(), on_error):
+            yield puzzle
+    elif fields and is_sudoku_line(head[-1].strip()):
+        for puzzle in read_sudoku_lines(head, 1, on_error):
+            yield puzzle
+        for puzzle in read_sudoku_lines(iter(f.readline, ''), len(head)+1, on_error):
+            yield puzzle
+    else:
+        for puzzle in read_lines(head, 1, on_error):
+            yield puzzle
+        for puzzle in read_lines(iter(f.readline, ''), len(head)+1, on_error):
+            yield puzzle
@@ -0,0 +1,183 @@
+"""Random puzzles
+
+    python generator.py [options] > puzzles.txt
+
+Puzzles are (name, size, info), as in grids.py (see formats.py).
+Every function takes a random.Random, so that a seed gives the same puzzles.
+
+By default, puzzles are only guaranteed to have a solution. With unique,
+clues are removed for as long as the solution stays unique: givens of a
+sudoku, and for a mathdoku, cages are merged starting from one cage per
+cell. This solves the puzzle for every clue, so it is much slower.
+"""
+import optparse
+import random
+import sys
+
+import formats
+import main
+
+def latin_square(size, rng):
+    """Random size x size latin square, as rows of values from 1 to size
+
+    A cyclic square with its rows, columns and values shuffled."""
+    rows = rng.sample(range(size), size)
+    cols = rng.sample(range(size), size)
+    values = rng.sample(range(1, size+1), size)
+    return [[values[(r + c) % size] for c in cols] for r in rows]
+
+def sudoku_solution(rng, box=3):
+    """Random solved sudoku (box*box x box*box), as rows of values
+
+    The usual pattern, with its bands, stacks, rows in bands, columns in
+    stacks and values shuffled."""
+    size = box*box
+    def shuffled_lines():
+        return [b*box + i for b in rng.sample(range(box), box) for i in rng.sample(range(box), box)]
+    rows, cols = shuffled_lines(), shuffled_lines()
+    values = rng.sample(range(1, size+1), size)
+    pattern = lambda r, c: (box*(r % box) + r//box + c) % size
+    return [[values[pattern(r, c)] for c in cols] for r in rows]
+
+def count_solutions(size, info, limit=2):
+    """Number of solutions of a puzzle, counting stops at limit"""
+    engine = "dlx" if main.is_sudoku(size) else "search"
+    return main.make_grid(size, info).count_solutions(limit, engine)
+
+def is_unique(size, info):
+    return count_solutions(size, info, 2) == 1
+
+def sudoku_puzzle(rng, givens=30, name=None, unique=False, box=3):
+    """Sudoku (box*box x box*box) with givens cells of a random solution
+
+    If unique, it starts with every cell given instead, and removes givens
+    (in random order) as long as the solution stays unique, but not below
+    givens."""
+    size = box*box
+    kind = 'sudoku' if box == 3 else 'sudoku%d' % (size,)
+    solution = sudoku_solution(rng, box)
+    cells = [(x, y) for y in range(size) for x in range(size)]
+    if not unique:
+        cells = sorted(rng.sample(cells, givens))
+    info = [["%d=" % (solution[y][x],), (x, y)] for x, y in cells]
+    if unique:
+        for blk in rng.sample(info, len(info)):
+            if len(info) <= givens:
+                break
+            fewer = [b for b in info if b is not blk]
+            if is_unique(kind, fewer):
+                info = fewer
+    return name or "%s-%d" % (kind, rng.getrandbits(32)), kind, info
+
+def carve_cages(size, rng, max_cells=4):
+    """Split the grid into random cages of connected cells (lists of (x, y))"""
+    free = set((x, y) for x in range(size) for y in range(size))
+    cages = []
+    for start in rng.sample(sorted(free), len(free)):
+        if start not in free:
+            continue
+        free.discard(start)
+        cage = [start]
+        wanted = rng.randint(1, max_cells)
+        while len(cage) < wanted:
+            around = [(x+dx, y+dy) for x, y in cage for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1))
+                        if (x+dx, y+dy) in free]
+            if not around:
+                break
+            cell = rng.choice(around)
+            free.discard(cell)
+            cage.append(cell)
+        cages.append(sorted(cage))
+    return cages
+
+def cage_condition(values, rng):
+    """Random condition (as in grids.py) that the values of a cage satisfy"""
+    if len(values) == 1:
+        return "%d=" % (values[0],)
+    ops = ["+", "*"]
+    if len(values) == 2:
+        big, small = max(values), min(values)
+        ops.append("-")
+        if big % small == 0:
+            ops.append("/")
+    op = rng.choice(ops)
+    if op == "+":
+        return "%d+" % (sum(values),)
+    elif op == "*":
+        return "%d*" % (reduce(lambda a, b: a*b, values, 1),)
+    elif op == "-":
+        return "%d-" % (big - small,)
+    else:
+        return "%d/" % (big // small,)
+
+def merge_cages(size, square, rng, max_cells=4):
+    """Cages (as info) with a unique solution, square
+
+    Starts from one cage per cell, and merges neighbour cages (with a new
+    random condition) for as long as the solution stays unique."""
+    info = [["%d=" % (square[y][x],), (x, y)] for y in range(size) for x in range(size)]
+    tried = set()
+    while True:
+        cage_of = dict((cpos, i) for i, blk in enumerate(info) for cpos in blk[1:])
+        pairs = set()
+        for i, blk in enumerate(info):
+            for x, y in blk[1:]:
+                for j in (cage_of.get((x+1, y)), cage_of.get((x, y+1))):
+                    if j is None or j == i or len(blk) + len(info[j]) - 2 > max_cells:
+                        continue
+                    pair = tuple(sorted([tuple(blk[1:]), tuple(info[j][1:])]))
+                    if pair not in tried:
+                        pairs.add((i, j, pair))
+        if not pairs:
+            return info
+        i, j, pair = rng.choice(sorted(pairs))
+        tried.add(pair)
+        cage = sorted(info[i][1:] + info[j][1:])
+        cond = cage_condition([square[y][x] for x, y in cage], rng)
+        merged = [blk for k, blk in enumerate(info) if k not in (i, j)] + [[cond] + cage]
+        if is_unique(size, merged):
+            info = merged
+
+def mathdoku_puzzle(size, rng, max_cells=4, name=None, unique=False):
+    """Mathdoku built on a random latin square"""
+    square = latin_square(size, rng)
+    if unique:
+        info = merge_cages(size, square, rng, max_cells)
+    else:
+        info = []
+        for cage in carve_cages(size, rng, max_cells):
+            cond = cage_condition([square[y][x] for x, y in cage], rng)
+            info.append([cond] + cage)
+    return name or "mathdoku%d-%d" % (size, rng.getrandbits(32)), size, info
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-n", "--count", type="int", default=1,
+                        help="number of puzzles (default: 1)")
+    parser.add_option("-s", "--size", default="sudoku",
+                        help="'sudoku' ('sudoku16', ... for bigger ones), or the size of the mathdoku (default: sudoku)")
+    parser.add_option("-g", "--givens", type="int", default=30,
+                        help="givens of a sudoku, the least of them with --unique (default: 30)")
+    parser.add_option("-m", "--max-cells", type="int", default=4,
+                        help="biggest mathdoku cage (default: 4)")
+    parser.add_option("-u", "--unique", action="store_true", default=False,
+                        help="remove clues as long as the solution is unique")
+    parser.add_option("--seed", type="int", default=None, help="random seed")
+    parser.add_option("-f", "--format", choices=["line", "add", "sudoku"], default="line",
+                        help="line (default), add (the grids.py format) or sudoku (81 cells a line)")
+    options, args = parser.parse_args()
+
+    rng = random.Random(options.seed)
+    write = {"line": formats.format_line, "add": formats.format_add,
+                "sudoku": formats.format_sudoku_line}[options.format]
+    for i in range(options.count):
+        if main.is_sudoku(options.size):
+            side, box = main.grid_dimensions(options.size)
+            puzzle = sudoku_puzzle(rng, options.givens, unique=options.unique, box=box)
+        else:
+            puzzle = mathdoku_puzzle(int(options.size), rng, options.max_cells,
+                                        unique=options.unique)
+        print write(*puzzle)
+        if options.format == "add":
+            print
+        sys.stdout.flush()
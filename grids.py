@@ -1,7 +1,9 @@
 
+# Read through library.py (without running this file), or imported for all_grids.
+# add() can also be given a difficulty="..." for the library's index.
 all_grids = {}
 
-def add(name, size, *info):
+def add(name, size, *info, **attributes):
     all_grids[name] = (size, info)
 
 add("first", 4,
@@ -1,10 +1,11 @@
 
-size = int(input("Size (or sudoku)?"))
+size = raw_input("Size (or sudoku, sudoku16, ...)?")
+size = int(size) if size.isdigit() else size
 
 blocks = []
 cells = []
 
-if size == 'sudoku':
+if not isinstance(size, int):
     print "Awaiting sudoku set values..."
     
     while True:
@@ -0,0 +1,217 @@
+"""Puzzle library
+
+The puzzles of grids.py, without running it or reading it all: an index
+(grids.idx, next to it) has the name, size, kind and difficulty of each
+puzzle, and where its add(...) call is in grids.py. A puzzle is only read
+when it is asked for, and looking for names only reads the index.
+
+    grids = library.default()           # or Library("other.py")
+    grids.names("sud")                  # names starting with "sud"
+    grids.search("hard")                # names containing "hard"
+    size, info = grids["hard"]          # as all_grids["hard"]
+    grids.add("mine", 4, ["8+", (0, 0), (0, 1), (1, 1)], ...)  # as in grids.py
+
+add(...) calls in grids.py can give a difficulty: add(name, size, ...,
+difficulty="hard"). Puzzles added with Library.add (which takes a
+difficulty too) are only kept in memory.
+
+The index is rebuilt when grids.py changes (its modification time or size
+are not the ones it was built for). It is a text file, sorted by name,
+with a header line then one line per puzzle:
+
+    name <TAB> size <TAB> sudoku|mathdoku <TAB> difficulty <TAB> offset <TAB> length
+
+offset and length locate its add(...) call in grids.py, in bytes.
+"""
+from collections import namedtuple
+import ast
+import heapq
+import mmap
+import os
+import re
+
+import formats
+import main
+
+Entry = namedtuple('Entry', 'name size kind difficulty offset length')
+
+INDEX_VERSION = "library1"
+
+# add(...) calls start lines, as input.py and formats.format_add write them
+ADD_CALL = re.compile(r"^add\(", re.M)
+
+def index_entries(text):
+    """Entries of the add(...) calls of a grids.py text, by name (the last one wins)
+
+    Each call is parsed on its own (with what follows it, up to the next
+    one), not the whole text at once: that would take a lot of memory."""
+    starts = [match.start() for match in ADD_CALL.finditer(text)]
+    entries = {}
+    for start, end in zip(starts, starts[1:] + [len(text)]):
+        call = ast.parse(text[start:end]).body[0].value
+        if len(call.args) < 2:
+            continue
+        name, size = ast.literal_eval(call.args[0]), ast.literal_eval(call.args[1])
+        difficulty = '-'
+        for keyword in call.keywords:
+            if keyword.arg == 'difficulty':
+                difficulty = str(ast.literal_eval(keyword.value))
+        if any(ch in field for ch in '\t\n' for field in (name, difficulty)):
+            raise ValueError("Puzzle %r: tabs and newlines can't be indexed" % (name,))
+        kind = 'sudoku' if main.is_sudoku(size) else 'mathdoku'
+        entries[name] = Entry(name, str(size), kind, difficulty, start, end - start)
+    return entries
+
+def build_index(source):
+    """Text of the index of a grids.py file"""
+    with open(source, 'rb') as f:
+        text = f.read()
+    stat = os.stat(source)
+    lines = ["#\t%s\t%r\t%d\n" % (INDEX_VERSION, stat.st_mtime, stat.st_size)]
+    for name, entry in sorted(index_entries(text).iteritems()):
+        lines.append("\t".join(str(field) for field in entry) + "\n")
+    return "".join(lines)
+
+def parse_entry(line):
+    name, size, kind, difficulty, offset, length = line.split("\t")
+    return Entry(name, size, kind, difficulty, int(offset), int(length))
+
+class Library(object):
+    """Puzzles of a grids.py file, found through its index (see the module docstring)"""
+    def __init__(self, source, index=None):
+        self.source = source
+        self.index = index or os.path.splitext(source)[0] + ".idx"
+        self.added = {} # name -> (entry, size, info) of the puzzles added with add()
+        self.data = self.open_index()
+        self.start = self.data.find("\n") + 1 # first line after the header
+
+    def open_index(self):
+        """The index (mmap, or string when it can't be written), rebuilt if it's out of date"""
+        stat = os.stat(self.source)
+        try:
+            with open(self.index, 'rb') as f:
+                header = f.readline().rstrip("\n").split("\t")
+                if header[1:] == [INDEX_VERSION, repr(stat.st_mtime), str(stat.st_size)]:
+                    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, IndexError):
+            pass
+        text = build_index(self.source)
+        try:
+            with open(self.index, 'wb') as f:
+                f.write(text)
+        except IOError:
+            return text
+        with open(self.index, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def line_start(self, pos):
+        return max(self.start, self.data.rfind("\n", self.start, pos) + 1)
+
+    def line_end(self, pos):
+        end = self.data.find("\n", pos)
+        return len(self.data) if end < 0 else end
+
+    def seek(self, name):
+        """Offset of the first line of the index whose name is not smaller than name"""
+        lo, hi = self.start, len(self.data)
+        while lo < hi:
+            start = self.line_start((lo + hi) // 2)
+            if self.data[start:self.data.find("\t", start)] < name:
+                lo = self.line_end(start) + 1
+            else:
+                hi = start
+        return lo
+
+    def entries_from(self, pos):
+        while pos < len(self.data):
+            end = self.line_end(pos)
+            yield parse_entry(self.data[pos:end])
+            pos = end + 1
+
+    def entry(self, name):
+        """Entry of a puzzle, None if there's none (offset and length are None for added ones)"""
+        if name in self.added:
+            return self.added[name][0]
+        pos = self.seek(name)
+        if pos < len(self.data) and self.data[pos:self.data.find("\t", pos)] == name:
+            return parse_entry(self.data[pos:self.line_end(pos)])
+        return None
+
+    def entries(self, prefix=""):
+        """Entries of the index whose name starts with prefix, sorted by name"""
+        for entry in self.entries_from(self.seek(prefix)):
+            if not entry.name.startswith(prefix):
+                return
+            yield entry
+
+    def matching_entries(self, text):
+        """Entries of the index whose name contains text, sorted by name"""
+        pos = self.start
+        while True:
+            pos = self.data.find(text, pos)
+            if pos < 0:
+                return
+            start = self.line_start(pos)
+            end = self.line_end(pos)
+            entry = parse_entry(self.data[start:end])
+            if text in entry.name:
+                yield entry
+            pos = end + 1
+
+    def merged(self, indexed, added):
+        """Names of the index and of the added puzzles, sorted"""
+        indexed = (entry.name for entry in indexed if entry.name not in self.added)
+        return heapq.merge(indexed, sorted(added))
+
+    def names(self, prefix=""):
+        """Names starting with prefix (every name by default), sorted"""
+        return self.merged(self.entries(prefix), (n for n in self.added if n.startswith(prefix)))
+
+    def search(self, text):
+        """Names containing text, sorted"""
+        if not text:
+            return self.names()
+        return self.merged(self.matching_entries(text), (n for n in self.added if text in n))
+
+    def add(self, name, size, *info, **attributes):
+        """Add a puzzle, as add() in grids.py: difficulty is the only attribute kept"""
+        difficulty = attributes.pop('difficulty', '-')
+        if attributes:
+            raise TypeError("add() only takes a difficulty, not %s" % (", ".join(sorted(attributes)),))
+        kind = 'sudoku' if main.is_sudoku(size) else 'mathdoku'
+        self.added[name] = (Entry(name, str(size), kind, str(difficulty), None, None), size, info)
+
+    def __contains__(self, name):
+        return self.entry(name) is not None
+
+    def __getitem__(self, name):
+        """(size, info) of a puzzle, as all_grids[name] in grids.py"""
+        if name in self.added:
+            entry, size, info = self.added[name]
+            return size, info
+        entry = self.entry(name)
+        if entry is None:
+            raise KeyError(name)
+        with open(self.source, 'rb') as f:
+            f.seek(entry.offset)
+            text = f.read(entry.length)
+        for found, size, info in formats.read_add(text):
+            return size, tuple(info)
+        raise KeyError(name)
+
+    def __iter__(self):
+        return self.names()
+
+DEFAULT_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "grids.py")
+_default = None
+
+def default():
+    """Library of the grids.py next to this file"""
+    global _default
+    if _default is None:
+        _default = Library(DEFAULT_SOURCE)
+    return _default
+
+def add(name, size, *info, **attributes):
+    """Register a puzzle in the default library"""
+    default().add(name, size, *info, **attributes)
@@ -0,0 +1,89 @@
+"""Load test the solver service
+
+    python service.py &
+    python loadtest.py [options] [file ...]
+
+Sends puzzles to a running service.py, one request per puzzle, from
+--concurrency threads at once. Files are read as by batch.py; without
+files, the grids of grids.py are sent. With --repeat, every puzzle is sent
+that many times (the later ones should come from the cache).
+
+It reports the throughput, the median and 95th percentile latency, and how
+many answers were solved, came from the cache or failed.
+"""
+from Queue import Queue
+import json
+import optparse
+import threading
+import time
+import urllib2
+
+import batch
+import bench
+
+def send(url, puzzle):
+    """Answer of the service for a (name, size, info) puzzle"""
+    name, size, info = puzzle
+    body = json.dumps({'name': name, 'size': size, 'info': info})
+    request = urllib2.Request(url, body, {'Content-Type': 'application/json'})
+    return json.load(urllib2.urlopen(request))
+
+def run(url, puzzles, concurrency=8):
+    """(seconds, [(latency, answer or None)]) of sending every puzzle"""
+    todo = Queue()
+    for puzzle in puzzles:
+        todo.put(puzzle)
+    results = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            puzzle = todo.get()
+            if puzzle is None:
+                return
+            start = time.time()
+            try:
+                answer = send(url, puzzle)
+            except (urllib2.URLError, IOError, ValueError):
+                answer = None
+            with lock:
+                results.append((time.time() - start, answer))
+
+    threads = [threading.Thread(target=worker) for i in range(concurrency)]
+    for thread in threads:
+        todo.put(None)
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start, results
+
+def report(seconds, results):
+    latencies = [latency for latency, answer in results]
+    answers = [answer for latency, answer in results]
+    failed = sum(1 for answer in answers if answer is None or answer['status'] == 'error')
+    cached = sum(1 for answer in answers if answer is not None and answer['cached'])
+    print "%d requests in %.3f s: %.1f requests/s" % (len(results), seconds, len(results) / seconds)
+    print "latency: median %.4f s, p95 %.4f s, max %.4f s" % (bench.percentile(latencies, 50),
+            bench.percentile(latencies, 95), max(latencies))
+    print "%d solved, %d from the cache, %d failed" % (len(results) - cached - failed, cached, failed)
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options] [file ...]")
+    parser.add_option("-u", "--url", default="http://127.0.0.1:8642/solve",
+                        help="solve URL of the service (default: http://127.0.0.1:8642/solve)")
+    parser.add_option("-c", "--concurrency", type="int", default=8,
+                        help="requests sent at once (default: 8)")
+    parser.add_option("-r", "--repeat", type="int", default=1,
+                        help="send every puzzle this many times (default: 1)")
+    options, paths = parser.parse_args()
+
+    if paths:
+        puzzles = list(batch.readable(batch.read_puzzles(paths)))
+    else:
+        from grids import all_grids
+        puzzles = [(name, size, info) for name, (size, info) in sorted(all_grids.iteritems())]
+    seconds, results = run(options.url, puzzles * options.repeat, options.concurrency)
+    if results:
+        report(seconds, results)
@@ -1,39 +1,359 @@
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from itertools import count, combinations_with_replacement
+import cPickle as pickle
+import heapq
+import itertools
+import time
 
-DO_LOG = False
-def log(level, *args):
-    if not DO_LOG: return
-    print "  "*level, " ".join(str(a) for a in args)
+import dlx
+import tracing
+
+class Contradiction(ValueError):
+    """Raised when the grid can't be solved anymore (a cell has no possible value)"""
+    pass
+
+class Domain(object):
+    """Set of candidate values stored as an integer bitmask (bit v <=> value v).
+    
+    Behaves like the set it replaces (in, len, iteration, add/discard and
+    the *_update methods), without allocating anything but an int."""
+    __slots__ = ('mask',)
+    
+    def __init__(self, values=()):
+        if isinstance(values, Domain):
+            self.mask = values.mask
+        else:
+            self.mask = Domain.mask_of(values)
+    
+    @staticmethod
+    def mask_of(values):
+        if isinstance(values, Domain):
+            return values.mask
+        if isinstance(values, (int, long)):
+            return 1 << values
+        m = 0
+        for v in values:
+            m |= 1 << v
+        return m
+    
+    @classmethod
+    def from_mask(cls, mask):
+        d = cls.__new__(cls)
+        d.mask = mask
+        return d
+    
+    @classmethod
+    def full(cls, size):
+        """All the values from 1 to size"""
+        return cls.from_mask(((1 << size) - 1) << 1)
+    
+    def popcount(self):
+        return bin(self.mask).count('1')
+    
+    def lowest(self):
+        """Smallest value in the domain, None if it's empty"""
+        m = self.mask
+        if not m:
+            return None
+        return (m & -m).bit_length() - 1
+    
+    def highest(self):
+        """Biggest value in the domain, None if it's empty"""
+        if not self.mask:
+            return None
+        return self.mask.bit_length() - 1
+    
+    def copy(self):
+        return Domain.from_mask(self.mask)
+    
+    def add(self, v):
+        self.mask |= 1 << v
+    
+    def discard(self, v):
+        self.mask &= ~(1 << v)
+    
+    def update(self, values):
+        self.mask |= Domain.mask_of(values)
+    
+    def difference_update(self, values):
+        self.mask &= ~Domain.mask_of(values)
+    
+    def intersection_update(self, values):
+        self.mask &= Domain.mask_of(values)
+    
+    def issubset(self, values):
+        return self.mask & ~Domain.mask_of(values) == 0
+    
+    def __and__(self, values):
+        return Domain.from_mask(self.mask & Domain.mask_of(values))
+    
+    def __or__(self, values):
+        return Domain.from_mask(self.mask | Domain.mask_of(values))
+    
+    def __sub__(self, values):
+        return Domain.from_mask(self.mask & ~Domain.mask_of(values))
+    
+    def __contains__(self, v):
+        return (self.mask >> v) & 1 == 1
+    
+    def __iter__(self):
+        m = self.mask
+        while m:
+            low = m & -m
+            yield low.bit_length() - 1
+            m ^= low
+    
+    def __len__(self):
+        return bin(self.mask).count('1')
+    
+    def __nonzero__(self):
+        return self.mask != 0
+    
+    def __eq__(self, values):
+        if isinstance(values, Domain):
+            return self.mask == values.mask
+        if isinstance(values, (set, frozenset)):
+            return set(self) == values
+        return NotImplemented
+    
+    def __ne__(self, values):
+        eq = self.__eq__(values)
+        return eq if eq is NotImplemented else not eq
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        return "D(%s)" % (list(self),)
+
+# Cage combination tables:
+#   COMBINATIONS[op, grid size, cage size] = {target: [(values, mask), ...]}
+# values is a sorted tuple (a multiset, a value can be repeated), mask is the
+# Domain mask of its distinct values. Each table is built once, the first time
+# a cage of that size is processed on a grid of that size.
+# Bigger cages than COMBINATIONS_MAX_CELLS are enumerated directly by their
+# condition's solve(), the tables would get too big for them.
+COMBINATIONS = {}
+COMBINATIONS_MAX_CELLS = 6
+COMBINATIONS_OPS = {
+    "+": lambda values: sum(values),
+    "*": lambda values: reduce(lambda a, b: a*b, values, 1),
+}
+
+def combinations(op, target, count, size):
+    """Multisets of count values in 1..size that give target with op"""
+    key = (op, size, count)
+    try:
+        table = COMBINATIONS[key]
+    except KeyError:
+        if tracing.on: tracing.emit("combinations", 0, "** Building combinations for", key)
+        table = COMBINATIONS[key] = defaultdict(list)
+        apply_op = COMBINATIONS_OPS[op]
+        for values in combinations_with_replacement(range(1, size+1), count):
+            table[apply_op(values)].append((values, Domain.mask_of(values)))
+        table.default_factory = None
+    return table.get(target, ())
+
+def load_combinations(path):
+    """Load tables saved by save_combinations, if the file exists"""
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return False
+    with f:
+        COMBINATIONS.update(pickle.load(f))
+    return True
+
+def save_combinations(path):
+    with open(path, 'wb') as f:
+        pickle.dump(COMBINATIONS, f, pickle.HIGHEST_PROTOCOL)
+
+def cage_tuples(op, target, all_poss, size, conflicts=None, rejected=None):
+    """Yield every assignment of all_poss (one Domain per cell) that gives target with op
+    
+    The tuples come from the combination tables, each one once. conflicts (see CageCondition.conflicts) removes the tuples where cells
+    of the same unique group have the same value."""
+    union = 0
+    required = 0 # the values of the cells with only one possible value
+    for poss in all_poss:
+        union |= poss.mask
+        if poss.mask & (poss.mask - 1) == 0:
+            required |= poss.mask
+    
+    for values, mask in combinations(op, target, len(all_poss), size):
+        if mask & ~union or required & ~mask:
+            continue
+        remaining = defaultdict(int)
+        for v in values:
+            remaining[v] += 1
+        for sol in place_values(remaining, all_poss, [], conflicts, rejected):
+            yield sol
+
+def place_values(remaining, all_poss, placed, conflicts=None, rejected=None):
+    """Yield the ways to put the remaining values (value -> count) in the cells, in order
+    
+    rejected (if given) is called for each value left out because of conflicts."""
+    i = len(placed)
+    if i == len(all_poss):
+        yield tuple(placed)
+        return
+    for v, n in remaining.items():
+        if n == 0 or v not in all_poss[i]:
+            continue
+        if conflicts and any(placed[j] == v and mask >> v & 1 for j, mask in conflicts[i]):
+            if rejected is not None:
+                rejected()
+            continue
+        remaining[v] -= 1
+        placed.append(v)
+        for sol in place_values(remaining, all_poss, placed, conflicts, rejected):
+            yield sol
+        placed.pop()
+        remaining[v] += 1
+
+class GroupRegistry(object):
+    """The attached groups of a grid, in the order they were added
+    
+    Groups that were indexed (see Grid.setup) can be found by their
+    signature (see Group.signature), and any group is removed in O(1)."""
+    def __init__(self):
+        self.groups = OrderedDict() # group -> signature (None if not indexed)
+        self.signatures = {}
+    
+    def add(self, grp, signature=None):
+        self.groups[grp] = signature
+        if signature is not None:
+            self.signatures[signature] = grp
+    
+    def index(self, grp):
+        self.add(grp, grp.signature())
+    
+    def remove(self, grp):
+        signature = self.groups.pop(grp)
+        if signature is not None and self.signatures.get(signature) is grp:
+            del self.signatures[signature]
+    
+    def find(self, signature):
+        return self.signatures.get(signature)
+    
+    def __iter__(self):
+        return iter(self.groups)
+    
+    def __len__(self):
+        return len(self.groups)
+    
+    def __contains__(self, grp):
+        return grp in self.groups
+
+def is_sudoku(size):
+    """If size (as in grids.py) is a sudoku one: 'sudoku' (9x9), or 'sudoku16', 'sudoku25', ..."""
+    return isinstance(size, basestring) and size.startswith('sudoku')
+
+def grid_dimensions(size):
+    """(cells per side, cells per side of a square) of a size as in grids.py (no squares: None)"""
+    if not is_sudoku(size):
+        return size, None
+    side = int(size[len('sudoku'):] or 9)
+    box = int(round(side**0.5))
+    if box**2 != side:
+        raise ValueError("A sudoku has to be n*n x n*n, not %dx%d" % (side, side))
+    return side, box
 
 class Grid(object):
+    # Remember the detached groups in removed_groups, and what processing found
+    # in Group.info (to look at them afterwards)
+    keep_removed_groups = False
+    keep_info = False
+    # a stats.Stats object to count what happens while solving (None: don't count)
+    stats = None
+    # hidden singles, naked/hidden subsets and pointing in unique groups (see UniqueCondition.infer)
+    unique_inference = True
+    
     def __init__(self, size):
-        if size == 'sudoku':
-            self.size = 9
-            self.sudoku = True
-        else:
-            self.size = size
-            self.sudoku = False
+        self.size, self.box = grid_dimensions(size)
+        self.sudoku = is_sudoku(size)
         self.nums = tuple(range(1, self.size+1))
+        self.nums_mask = Domain.full(self.size).mask
         self.cells = {(x, y): Cell(self, x, y) for x in range(self.size) for y in range(self.size)}
-        self.groups = []
+        self.groups = GroupRegistry()
         self.removed_groups = []
         
+        # groups waiting to be processed: heap of (sort key, tie breaker, group)
+        self.queue = []
+        self.queue_counter = count()
+        # groups whose slower deductions (UniqueCondition.infer) wait for the queue to be empty
+        self.inference_queue = OrderedDict()
+        # groups that were not compared to the others yet (see update_group_inclusions)
+        self.unindexed_groups = []
+        
+        # undo log used while searching: list of (function, args), None when not searching
+        self.trail = None
+        self.search_stats = {'nodes': 0, 'backtracks': 0}
+        
         self.__setup = False
     
     def add_group(self, grp):
         if not self.__setup:
-            self.groups.append(grp)
+            self.groups.add(grp)
+            self.unindexed_groups.append(grp)
     
     def remove_group(self, grp):
         self.groups.remove(grp)
-        self.removed_groups.append(grp)
+        if self.stats is not None:
+            self.stats.add(grp.condition, 'detached')
+        if self.keep_removed_groups:
+            self.removed_groups.append(grp)
+        self.save(self.unremove_group, grp)
+    
+    def unremove_group(self, grp):
+        if self.keep_removed_groups:
+            self.removed_groups.pop()
+        self.groups.index(grp)
+        grp.is_attached = True
     
     def group_merge(self, group):
-        if any(grp == group for grp in self.groups):
-            log(0, "**", "I won't add", group)
+        signature = group.signature()
+        if self.groups.find(signature) is not None:
+            if tracing.on: tracing.emit(self, 0, "**", "I won't add", group)
+            group.is_attached = False
         else:
-            log(0, "**", "Adding", group)
-            self.groups.append(group)
+            if tracing.on: tracing.emit(self, 0, "**", "Adding", group)
+            self.groups.add(group, signature)
+            if self.stats is not None:
+                self.stats.add(group.condition, 'spawned')
+            self.save(self.unmerge_group, group)
+            self.unindexed_groups.append(group)
+            self.enqueue(group)
+    
+    def unmerge_group(self, group):
+        self.groups.remove(group)
+        group.is_attached = False
+    
+    def enqueue(self, grp):
+        """Schedule a group to be processed (again), if it's not already"""
+        if not self.__setup or not grp.is_attached or grp.is_queued:
+            return
+        grp.is_queued = True
+        heapq.heappush(self.queue, (self.sort_groups(grp), next(self.queue_counter), grp))
+    
+    def save(self, undo, *args):
+        """Remember how to undo a change, when searching"""
+        if self.trail is not None:
+            self.trail.append((undo, args))
+    
+    def undo(self, mark):
+        """Undo every change done since len(self.trail) was mark"""
+        while len(self.trail) > mark:
+            undo, args = self.trail.pop()
+            undo(*args)
+        for key, i, grp in self.queue:
+            grp.is_queued = False
+        self.queue = []
+        self.inference_queue.clear()
+    
+    def cell_changed(self, cell):
+        """The domain (or value) of a cell changed: its groups have to be processed again"""
+        for grp in cell.groups:
+            self.enqueue(grp)
     
     def at(self, x, y):
         return self.cells[x, y]
@@ -51,14 +371,14 @@ class Grid(object):
         
         if self.sudoku:
             blks = {}
-            for x in range(3):
-                for y in range(3):
+            for x in range(self.box):
+                for y in range(self.box):
                     blks[x,y] = b = Block(self)
                     b.set(UniqueCondition(self.nums))
             
             for x in range(self.size):
                 for y in range(self.size):
-                    blks[int(x/3), int(y/3)].add(self.at(x,y))
+                    blks[x//self.box, y//self.box].add(self.at(x,y))
         
         for c in self:
             assert c.has_block(), "The cell at position (%d,%d) that does not have a block!" % (c.x, c.y)
@@ -70,6 +390,11 @@ class Grid(object):
                 SumCondition, DivisionCondition, DifferenceCondition)
         self.sort_conds = {cond: i for i, cond in enumerate(conds)}
         
+        # the rules of the game, whatever happens to self.groups afterwards
+        self.initial_groups = list(self.groups)
+        # the groups have all their cells now, they can be found by signature
+        [self.groups.index(grp) for grp in self.initial_groups]
+        
         self.__setup = True
     
     def validate(self):
@@ -80,34 +405,283 @@ class Grid(object):
             return True
     
     def process(self):
-        self.update_group_inclusions()
-        self.process_groups()
+        """Propagate until nothing changes anymore"""
+        if not self.queue:
+            # nothing was scheduled (first call, or it's a forced run): do everything
+            [self.enqueue(grp) for grp in self.groups]
+        if self.stats is None:
+            self.process_groups()
+            return
+        
+        start = time.time()
+        try:
+            self.process_groups()
+        finally:
+            self.stats.process_calls += 1
+            self.stats.process_time += time.time() - start
+    
+    def solve(self, engine="search"):
+        """Propagate, and guess when stuck (depth-first, fewest possible values first)
+        
+        Returns the grid if it was solved, None if it has no solution.
+        Node and backtrack counts are in self.search_stats.
+        
+        With engine="dlx", the grid is solved as an exact cover problem
+        instead (see exact_cover), which is much faster for sudokus."""
+        self.search_stats = {'nodes': 0, 'backtracks': 0}
+        if engine == "dlx":
+            return self.solve_exact_cover()
+        elif engine != "search":
+            raise ValueError("Unknown engine %r" % (engine,))
+        outer_trail = self.trail # there is one if a snapshot was taken
+        if outer_trail is None:
+            self.trail = []
+        try:
+            solved = self.search()
+        finally:
+            if outer_trail is None:
+                self.trail = None
+            if self.stats is not None:
+                self.stats.search = dict(self.search_stats)
+        return self if solved else None
+    
+    def count_solutions(self, limit=2, engine="search"):
+        """Number of solutions, counting stops as soon as limit are found
+        
+        count_solutions(2) tells if there is none, one or more than one.
+        The grid is left as it was, node and backtrack counts are in
+        self.search_stats. engine is as in solve."""
+        self.search_stats = {'nodes': 0, 'backtracks': 0}
+        if engine == "dlx":
+            X, Y = self.exact_cover()
+            found = 0
+            for rows in dlx.exact_cover(X, Y, self.search_stats):
+                found += 1
+                if found >= limit:
+                    break
+            return found
+        elif engine != "search":
+            raise ValueError("Unknown engine %r" % (engine,))
+        if self.trail is None:
+            self.trail = []
+            outer_trail = None
+        else:
+            outer_trail = self.trail
+        mark = len(self.trail)
+        try:
+            return self.search_count(limit)
+        finally:
+            self.undo(mark)
+            if outer_trail is None:
+                self.trail = None
+            if self.stats is not None:
+                self.stats.search = dict(self.search_stats)
+    
+    def exact_cover(self):
+        """Columns and rows of this grid as an exact cover problem (see dlx.py)
+        
+        Only grids made of groups with all the values (rows, columns and
+        sudoku blocks) and of givens (one cell "=" groups, or cells with one
+        possible value) can be solved this way. Rows are
+        (x, y, value), the columns are ('cell', x, y), and (group number,
+        value) for each group with all the values."""
+        givens = {}
+        houses = defaultdict(list) # cell -> numbers of the groups with all the values
+        for i, grp in enumerate(self.initial_groups):
+            cond = grp.condition
+            if isinstance(cond, UniqueCondition) and len(grp) == self.size and cond.value == set(self.nums):
+                for c in grp:
+                    houses[c].append(i)
+            elif isinstance(cond, EqualityCondition) and len(grp) == 1:
+                givens.setdefault(grp[0], Domain(self.nums)).intersection_update([cond.value])
+            else:
+                raise ValueError("%s can't be solved as an exact cover" % (grp,))
         
+        X = {}
+        Y = {}
+        for c in self:
+            possible = c.possible & givens[c] if c in givens else c.possible
+            for v in possible:
+                Y[c.x, c.y, v] = [('cell', c.x, c.y)] + [(i, v) for i in houses[c]]
+            X['cell', c.x, c.y] = set()
+            for i in houses[c]:
+                for v in self.nums:
+                    X[i, v] = set()
+        for row, cols in Y.iteritems():
+            for col in cols:
+                X[col].add(row)
+        return X, Y
+    
+    def solve_exact_cover(self):
+        X, Y = self.exact_cover()
+        try:
+            for rows in dlx.exact_cover(X, Y, self.search_stats):
+                for x, y, v in rows:
+                    self.at(x, y).value = v
+                return self
+            return None
+        finally:
+            if self.stats is not None:
+                self.stats.search = dict(self.search_stats)
+    
+    def snapshot(self):
+        """Token to come back to the current state with restore(token)
+        
+        Changes are recorded from the first snapshot on."""
+        if self.trail is None:
+            self.trail = []
+        return len(self.trail)
+    
+    def restore(self, token):
+        self.undo(token)
+    
+    def clone(self):
+        """Independent copy of this grid, without deep copying it
+        
+        Cells, groups and conditions are new objects, since they point to each
+        other, but what is never changed in place (condition values, certain
+        values, sort tables, ...) is shared with this grid."""
+        g = Grid.__new__(Grid)
+        g.__dict__.update(self.__dict__)
+        
+        cells = dict((c, c.copy(g)) for c in self)
+        g.cells = dict((pos, cells[c]) for pos, c in self.cells.iteritems())
+        
+        groups = {}
+        for grp in self.initial_groups + list(self.groups):
+            if grp not in groups:
+                groups[grp] = grp.copy(g, cells)
+        for grp, new in groups.iteritems():
+            new.included_groups = set(groups[i] for i in grp.included_groups if i in groups)
+        for c, new in cells.iteritems():
+            new.groups = [groups[grp] for grp in c.groups if grp in groups]
+            new.block = groups.get(c.block)
+        
+        g.groups = GroupRegistry()
+        for grp, signature in self.groups.groups.iteritems():
+            g.groups.add(groups[grp], signature)
+        g.removed_groups = []
+        g.initial_groups = [groups[grp] for grp in self.initial_groups]
+        g.unindexed_groups = [groups[grp] for grp in self.unindexed_groups if grp in groups]
+        
+        g.queue = []
+        g.queue_counter = count()
+        for key, i, grp in sorted(self.queue):
+            groups[grp].is_queued = False
+            g.enqueue(groups[grp])
+        g.inference_queue = OrderedDict((groups[grp], None) for grp in self.inference_queue)
+        
+        g.trail = None
+        g.search_stats = {'nodes': 0, 'backtracks': 0}
+        return g
+    
+    def search(self):
+        self.search_stats['nodes'] += 1
+        try:
+            self.process()
+        except Contradiction as e:
+            if tracing.on: tracing.emit(self, 0, "!!", e)
+            return False
+        
+        free = [c for c in self if c.value is None]
+        if not free:
+            return all(grp.validate() for grp in self.initial_groups)
+        
+        cell = min(free, key=lambda c: (len(c.possible), c.y, c.x))
+        for v in list(cell.possible):
+            if tracing.on: tracing.emit(self, 0, "?? Trying", cell, "=", v)
+            mark = len(self.trail)
+            cell.value = v
+            if self.search():
+                return True
+            self.undo(mark)
+            self.search_stats['backtracks'] += 1
+        return False
+    
+    def search_count(self, limit):
+        """Like search, but counts the solutions (up to limit) instead of stopping at the first"""
+        self.search_stats['nodes'] += 1
+        try:
+            self.process()
+        except Contradiction as e:
+            if tracing.on: tracing.emit(self, 0, "!!", e)
+            return 0
+        
+        free = [c for c in self if c.value is None]
+        if not free:
+            return 1 if all(grp.validate() for grp in self.initial_groups) else 0
+        
+        cell = min(free, key=lambda c: (len(c.possible), c.y, c.x))
+        found = 0
+        for v in list(cell.possible):
+            if tracing.on: tracing.emit(self, 0, "?? Trying", cell, "=", v)
+            mark = len(self.trail)
+            cell.value = v
+            count = self.search_count(limit - found)
+            self.undo(mark)
+            if not count:
+                self.search_stats['backtracks'] += 1
+            found += count
+            if found >= limit:
+                break
+        return found
+    
     def update_group_inclusions(self):
-        grp_cells = [(grp, set(grp.cells)) for grp in self.groups]
-        for i, (grp1, cells1) in enumerate(grp_cells):
-            for grp2, cells2 in grp_cells[i+1:]:
-                if cells1.issubset(cells2):
-                    grp2.set_includes(grp1)
-                elif cells2.issubset(cells1):
-                    grp1.set_includes(grp2)
+        """Compare the groups added since last time with the ones sharing a cell
+        
+        Groups are compared through the bits of their cells (Group.cell_mask),
+        and only with the attached groups of their own cells. When two groups
+        have the same cells, the newest one includes the other."""
+        pending, self.unindexed_groups = self.unindexed_groups, []
+        for grp in pending:
+            if not grp.is_attached:
+                continue
+            grp.cell_mask = mask = sum(c.bit for c in grp)
+            
+            others = set()
+            for c in grp:
+                others.update(c.groups)
+            for other in others:
+                if other is grp or not other.is_attached or other.cell_mask is None:
+                    continue
+                if other.cell_mask & ~mask == 0:
+                    grp.set_includes(other)
+                elif mask & ~other.cell_mask == 0:
+                    other.set_includes(grp)
+    
+    def enqueue_inference(self, grp):
+        """Schedule the slower deductions of a group, for when nothing else is left to do"""
+        self.inference_queue[grp] = None
     
     def process_groups(self):
-        self.groups.sort(key=self.sort_groups)
-        
-        for grp in self.groups[:]:
-            grp.process()
+        while self.queue or self.inference_queue:
+            # cheap conditions first (see sort_conds), then smaller groups
+            while self.queue:
+                if self.unindexed_groups:
+                    self.update_group_inclusions()
+                grp = heapq.heappop(self.queue)[2]
+                grp.is_queued = False
+                if grp.is_attached:
+                    grp.process()
+            if self.inference_queue:
+                grp = self.inference_queue.popitem(last=False)[0]
+                if grp.is_attached:
+                    grp.infer()
     
     def sort_groups(self, grp):
-        return (self.sort_conds[grp.condition.__class__],
-                len(grp),
-                min(grp.cells))
+        # groups are only queued once they have all their cells: the key can be kept
+        if grp.sort_key is None:
+            grp.sort_key = (self.sort_conds[grp.condition.__class__],
+                            len(grp),
+                            min(grp.cells))
+        return grp.sort_key
     
     def display(self, only_numbers=True):
         if only_numbers:
+            width = len(str(self.size))
             for y in range(self.size):
                 for c in self.row(y):
-                    print c.value if c.value is not None else '_',
+                    print "%*s" % (width, c.value if c.value is not None else '_'),
                 print
         else:
             grp_info = defaultdict(str)
@@ -128,14 +702,17 @@ class Grid(object):
         return self.cells.itervalues()
 
 class Cell(object):
+    __slots__ = ('grid', 'x', 'y', 'bit', 'block', 'groups', '__value', '__possible_values')
+    
     def __init__(self, grid, x, y):
         self.grid = grid
         self.x, self.y = x, y
+        self.bit = 1 << (y*grid.size + x) # this cell in Group.cell_mask
         self.block = None
         self.groups = []
         
         self.__value = None
-        self.__possible_values = set(self.grid.nums)
+        self.__possible_values = Domain.from_mask(self.grid.nums_mask)
     
     @property
     def value(self):
@@ -143,22 +720,29 @@ class Cell(object):
     
     @value.setter
     def value(self, v):
-        log(0, "*"*5, self, "=", v, "?")
+        if tracing.on: tracing.emit(self, 0, "*"*5, self, "=", v, "?")
+        old = self.__value, self.__possible_values.mask
         self.__value = v
-        if v is not None:
-            self.update_value()
+        try:
+            if v is not None:
+                self.update_value()
+        finally:
+            self.notify(old)
     
     def has_value(self):
         return self.value is not None
     
     def update_value(self):
         L = len(self.possible)
-        assert L > 0, "No possible value for %s?" % (self,)
+        if L == 0:
+            raise Contradiction("No possible value for %s?" % (self,))
         if self.value is None and L == 1:
-            self.__value = list(self.possible)[0]
-            log(0, "*"*10, self, "=", self.__value, "!")
+            self.__value = self.possible.lowest()
+            if tracing.on: tracing.emit(self, 0, "*"*10, self, "=", self.__value, "!")
+        elif self.value is not None and self.value not in self.possible:
+            raise Contradiction("%s = %s is not possible (%s)" % (self, self.value, self.possible))
         elif self.value is not None and L > 1:
-            self.__possible_values = set([self.value])
+            self.__possible_values = Domain.from_mask(1 << self.value)
     
     @property
     def possible(self):
@@ -166,27 +750,65 @@ class Cell(object):
     
     @possible.setter
     def possible(self, values):
+        old = self.__value, self.__possible_values.mask
         if values is None:
-            values = self.grid.nums
-        self.__possible_values = set(values)
-        self.update_value()
+            self.__possible_values = Domain.from_mask(self.grid.nums_mask)
+        else:
+            self.__possible_values = Domain(values)
+        try:
+            self.update_value()
+        finally:
+            self.notify(old)
     
     def restrict(self, v):
-        if type(v) == int:
-            self.possible.discard(v)
-        else:
-            self.possible.difference_update(set(v))
-        self.update_value()
+        mask = Domain.mask_of(v)
+        if not self.__possible_values.mask & mask:
+            return # nothing to remove: the common case, keep it cheap
+        old = self.__value, self.__possible_values.mask
+        self.__possible_values.mask &= ~mask
+        try:
+            self.update_value()
+        finally:
+            self.notify(old)
     
     def allow(self, v):
-        if type(v) == int:
-            self.possible.add(v)
-        else:
-            self.possible.update(set(v))
-        self.update_value()
+        mask = Domain.mask_of(v)
+        if self.__possible_values.mask & mask == mask:
+            return
+        old = self.__value, self.__possible_values.mask
+        self.__possible_values.mask |= mask
+        try:
+            self.update_value()
+        finally:
+            self.notify(old)
+    
+    def copy(self, grid):
+        """Same cell in another grid, without its groups (see Grid.clone)"""
+        c = Cell.__new__(Cell)
+        c.grid = grid
+        c.x, c.y, c.bit = self.x, self.y, self.bit
+        c.block = None
+        c.groups = []
+        c.__value = self.__value
+        c.__possible_values = self.__possible_values.copy()
+        return c
+    
+    def notify(self, old):
+        """Tell the grid if the (value, possible) pair changed since old"""
+        if old != (self.__value, self.__possible_values.mask):
+            if self.grid.stats is not None:
+                removed = old[1] & ~self.__possible_values.mask
+                self.grid.stats.eliminations[self.x, self.y] += Domain.from_mask(removed).popcount()
+            self.grid.save(self.restore, old)
+            self.grid.cell_changed(self)
+    
+    def restore(self, state):
+        self.__value, mask = state
+        self.__possible_values = Domain.from_mask(mask)
     
     def add_group(self, grp):
         self.groups.append(grp)
+        self.grid.save(self.groups.pop)
     
     def set_block(self, block):
         self.block = block
@@ -201,6 +823,9 @@ class Cell(object):
         return "c(%d,%d)" % (self.x, self.y)
 
 class Group(object):
+    __slots__ = ('grid', 'cells', 'condition', 'certain_values', 'included_groups',
+                 'cell_mask', 'info', 'is_attached', 'is_queued', 'sort_key')
+    
     def __init__(self, grid):
         self.grid = grid
         self.cells = [] # order is important! (even though there should not be duplicates)
@@ -208,10 +833,13 @@ class Group(object):
         
         self.certain_values = set([])
         self.included_groups = set([])
+        self.cell_mask = None # set once compared to the other groups
         
         self.info = None
         
         self.is_attached = False
+        self.is_queued = False
+        self.sort_key = None # see Grid.sort_groups
         self.attach()
     
     def attach(self):
@@ -231,20 +859,60 @@ class Group(object):
         self.condition = condition
         self.condition.assign(self)
     
+    def copy(self, grid, cells):
+        """Same group in another grid, cells maps this grid's cells to the other's
+        
+        included_groups is left empty (see Grid.clone)."""
+        grp = self.__class__.__new__(self.__class__)
+        grp.grid = grid
+        grp.cells = [cells[c] for c in self.cells]
+        grp.condition = self.condition.copy(grp) if self.condition is not None else None
+        grp.certain_values = self.certain_values
+        grp.included_groups = set()
+        grp.cell_mask = self.cell_mask
+        grp.info = self.info
+        grp.is_attached = self.is_attached
+        grp.is_queued = self.is_queued
+        grp.sort_key = None # it holds a cell of this grid
+        return grp
+    
     def restrict(self, value):
+        value = Domain(value) # value can be a generator, only consume it once
         [c.restrict(value) for c in self]
     
     def allow(self, value):
+        value = Domain(value)
         [c.allow(value) for c in self]
     
     def certain(self, values):
-        self.certain_values = set(values)
+        values = set(values)
+        if values != self.certain_values:
+            # groups including this one rely on its certain values
+            self.grid.save(setattr, self, 'certain_values', self.certain_values)
+            [self.grid.cell_changed(c) for c in self]
+        self.certain_values = values
         if len(self.certain_values) == len(self):
+            certain = Domain.mask_of(self.certain_values)
             for c in self:
-                c.possible.intersection_update(values)
+                if c.possible.mask & ~certain:
+                    c.possible = Domain.from_mask(c.possible.mask & certain)
+    
+    def signature(self):
+        """Groups with the same signature are the same (same cells, same condition)"""
+        value = self.condition.value
+        if isinstance(value, (set, frozenset)):
+            value = frozenset(value)
+        return (sum(c.bit for c in self), type(self.condition), value)
+    
+    def set_info(self, info):
+        """Keep what processing found (solutions, ...), to look at it afterwards"""
+        if self.grid.keep_info:
+            self.info = info
     
     def set_includes(self, group):
-        self.included_groups.add(group)
+        if group not in self.included_groups:
+            self.included_groups.add(group)
+            self.grid.save(self.included_groups.discard, group)
     
     def includes(self, group):
         return group in self.included_groups
@@ -253,8 +921,32 @@ class Group(object):
         return self.condition.validate()
     
     def process(self):
-        log(0, "#", "Processing", self)
-        self.condition.process()
+        if tracing.on: tracing.emit(self.condition, 0, "#", "Processing", self)
+        stats = self.grid.stats
+        if stats is None:
+            self.condition.process()
+            return
+        
+        start = time.time()
+        try:
+            self.condition.process()
+        finally:
+            counters = stats.condition(self.condition)
+            counters['calls'] += 1
+            counters['time'] += time.time() - start
+    
+    def infer(self):
+        """Slower deductions of the condition (see Grid.enqueue_inference), timed like process"""
+        stats = self.grid.stats
+        if stats is None:
+            self.condition.infer()
+            return
+        
+        start = time.time()
+        try:
+            self.condition.infer()
+        finally:
+            stats.condition(self.condition)['time'] += time.time() - start
     
     def __getitem__(self, i):
         return self.cells[i]
@@ -276,6 +968,8 @@ class Group(object):
         return "G(c%d, %s, %s)" % (len(self), self.condition, self.cells)
 
 class Block(Group):
+    __slots__ = ()
+    
     def __init__(self, grid):
         super(Block, self).__init__(grid)
     
@@ -288,6 +982,8 @@ class Block(Group):
         return "B(c%d, %s)" % (len(self), self.condition)
 
 class Row(Group):
+    __slots__ = ('y',)
+    
     def __init__(self, grid, y):
         super(Row, self).__init__(grid)
         
@@ -296,10 +992,17 @@ class Row(Group):
         self.set(UniqueCondition(list(self.grid.nums)))
         [self.add(c) for c in self.grid.row(self.y)]
     
+    def copy(self, grid, cells):
+        grp = super(Row, self).copy(grid, cells)
+        grp.y = self.y
+        return grp
+    
     def __repr__(self):
         return "R(c%d, (x, %d))" % (len(self), self.y)
 
 class Column(Group):
+    __slots__ = ('x',)
+    
     def __init__(self, grid, x):
         super(Column, self).__init__(grid)
         
@@ -308,10 +1011,17 @@ class Column(Group):
         self.set(UniqueCondition(list(self.grid.nums)))
         [self.add(c) for c in self.grid.column(self.x)]
     
+    def copy(self, grid, cells):
+        grp = super(Column, self).copy(grid, cells)
+        grp.x = self.x
+        return grp
+    
     def __repr__(self):
         return "C(c%d, (%d, y))" % (len(self), self.x)
 
 class Condition(object):
+    __slots__ = ('value', 'group', 'grid')
+    
     def __init__(self, value):
         self.value = value
         self.group = None
@@ -321,27 +1031,19 @@ class Condition(object):
         self.group = group
         self.grid = self.group.grid
     
+    def copy(self, group):
+        """Same condition, for the copy of its group"""
+        cond = self.__class__.__new__(self.__class__)
+        cond.value = self.value
+        cond.assign(group)
+        return cond
+    
     def validate(self):
         return False
     
-    def filter_solutions(self, grp, sols):
-        pass
-    
     def process(self):
         pass
     
-    def get_filtered_solutions(self, sols):
-        groups = set()
-        for c in self.group:
-            groups.update(set(c.groups))
-        
-        sols = sols.copy()
-        for grp in groups:
-            if not isinstance(grp.condition, UniqueCondition): continue
-            sols = grp.condition.filter_solutions(self.group, sols)
-        
-        return sols
-    
     def __eq__(self, cond):
         return type(self) == type(cond) and self.value == cond.value
     
@@ -356,6 +1058,8 @@ class UniqueCondition(Condition):
     #         and UniqueCondition (contain at most one value of self.value)
     # The idea is still not clear, I'll check that
     
+    __slots__ = ()
+    
     def __init__(self, value):
         super(UniqueCondition, self).__init__(set(value))
     
@@ -371,19 +1075,6 @@ class UniqueCondition(Condition):
         else:
             return True
 
-    def filter_solutions(self, grp, sols):
-        sols = sols.copy()
-        cell_indices = [i for i, c in enumerate(grp) if c in self.group.cells]
-        
-        for s in sols.copy():
-            values = [s[i] for i in cell_indices]
-            for v in self.value:
-                if values.count(v) > 1:
-                    sols.remove(s)
-                    break
-        
-        return sols
-
     def process(self):
         self.group.certain(self.value)
         
@@ -394,26 +1085,143 @@ class UniqueCondition(Condition):
                 remaining_values -= set(grp.certain_values)
                 remaining_cells -= set(grp.cells)
         
-        taken_values = set(self.value)-remaining_values
+        taken_values = Domain(set(self.value)-remaining_values)
         for c in remaining_cells:
             c.restrict(taken_values)
         
         if self.desintegrate():
             return
         
-        self.info = [remaining_cells, remaining_values]
+        self.group.set_info([remaining_cells, remaining_values])
+        
+        if self.grid.unique_inference and self.group.is_attached:
+            self.grid.enqueue_inference(self.group)
+    
+    # biggest naked/hidden subsets looked for (pairs, triples)
+    max_subset = 3
+    
+    def infer(self):
+        """Deductions from where each value can go in the group
+        
+        Every value must be in the group exactly once, so:
+         * hidden single: a value that fits in one cell only is there
+         * naked subset: when k cells can only hold the same k values,
+           the other cells can't hold them
+         * hidden subset: when k values only fit in the same k cells,
+           those cells can't hold anything else
+         * pointing: when a value only fits in cells that are also in
+           another unique group, the rest of that group can't hold it
+        They all work on an index of the cells each value fits in (bits
+        of the positions in cells), built again on each call from the
+        unsolved cells: keeping it up to date would cost something on
+        every change of a domain, and this only runs once the queue is
+        empty. Once something changed, the group is queued again (through
+        Cell.notify): it stops there.
+        
+        This runs once the queue is empty (see Grid.enqueue_inference), the
+        cheap deductions often make it unnecessary."""
+        cells = [c for c in self.group if c.value is None]
+        if len(cells) < 2:
+            return
+        taken = set(c.value for c in self.group if c.value is not None)
+        places = dict((v, 0) for v in self.value if v not in taken)
+        for i, c in enumerate(cells):
+            for v in c.possible:
+                if v in places:
+                    places[v] |= 1 << i
+        
+        # hidden singles
+        singles = []
+        for v, where in places.iteritems():
+            if where == 0:
+                raise Contradiction("%s can't be anywhere in %s" % (v, self.group))
+            if where & (where - 1) == 0:
+                singles.append((cells[where.bit_length() - 1], v))
+        if singles:
+            for c, v in singles:
+                if tracing.on: tracing.emit(self, 1, "hidden single", c, "=", v)
+                c.value = v
+            return
         
+        if self.infer_subsets(cells, places):
+            return
+        self.infer_pointing(cells, places)
+    
+    def infer_subsets(self, cells, places):
+        """Naked and hidden subsets, True if something was found"""
+        values_mask = Domain.mask_of(places)
+        masks = [c.possible.mask for c in cells]
+        n = len(cells)
+        for k in range(2, min(self.max_subset, n - 1) + 1):
+            # naked: cells whose values (all of this group) are at most k
+            small = [i for i in range(n) if masks[i] & ~values_mask == 0 and
+                                            Domain.from_mask(masks[i]).popcount() <= k]
+            for subset in itertools.combinations(small, k):
+                union = 0
+                for i in subset:
+                    union |= masks[i]
+                if Domain.from_mask(union).popcount() != k:
+                    continue
+                others = [cells[i] for i in range(n) if i not in subset and masks[i] & union]
+                if others:
+                    if tracing.on: tracing.emit(self, 1, "naked subset", [cells[i] for i in subset], Domain.from_mask(union))
+                    removed = Domain.from_mask(union)
+                    for c in others:
+                        c.restrict(removed)
+                    return True
+            
+            # hidden: values that fit in at most k cells
+            few = [v for v, where in places.iteritems() if Domain.from_mask(where).popcount() <= k]
+            for subset in itertools.combinations(few, k):
+                where = 0
+                for v in subset:
+                    where |= places[v]
+                if Domain.from_mask(where).popcount() != k:
+                    continue
+                kept = Domain.mask_of(subset)
+                inside = [cells[i] for i in range(n) if where >> i & 1 and masks[i] & ~kept]
+                if inside:
+                    if tracing.on: tracing.emit(self, 1, "hidden subset", subset, inside)
+                    for c in inside:
+                        c.restrict(Domain.from_mask(c.possible.mask & ~kept))
+                    return True
+        return False
     
+    def infer_pointing(self, cells, places):
+        """Pointing (and claiming, seen from the other group)"""
+        for v, where in places.iteritems():
+            there = [cells[i] for i in range(len(cells)) if where >> i & 1]
+            bits = sum(c.bit for c in there)
+            for other in there[0].groups:
+                if other is self.group or not other.is_attached:
+                    continue
+                cond = other.condition
+                if not isinstance(cond, UniqueCondition) or v not in cond.value:
+                    continue
+                other_mask = other.cell_mask
+                if other_mask is None:
+                    other_mask = sum(c.bit for c in other)
+                if bits & ~other_mask:
+                    continue
+                outside = [c for c in other if c not in there and c.value is None and v in c.possible]
+                if outside:
+                    if tracing.on: tracing.emit(self, 1, "pointing", v, there, "->", other)
+                    for c in outside:
+                        c.restrict(v)
+    
+
     def desintegrate(self):
         remaining_values = set(self.value)
         remaining_cells = set(self.group.cells)
         
         for c in self.group:
             if c.value is not None:
+                if c.value not in remaining_values:
+                    raise Contradiction("%s = %s twice in %s" % (c, c.value, self.group))
                 remaining_cells.discard(c)
                 remaining_values.discard(c.value)
         
-        taken_values = set(self.value)-remaining_values
+        taken_values = Domain(set(self.value)-remaining_values)
         for c in remaining_cells:
             c.restrict(taken_values)
         
@@ -423,7 +1231,7 @@ class UniqueCondition(Condition):
             pass
         elif len(remaining_cells) == 1:
             r = list(remaining_cells)
-            print r[0], "=", r[0].value
+            if tracing.on: tracing.emit(self, 0, r[0], "=", r[0].value)
         else:
             grp = Group(self.grid)
             [grp.add(c) for c in remaining_cells]
@@ -436,6 +1244,8 @@ class UniqueCondition(Condition):
         return ""
 
 class EqualityCondition(Condition):
+    __slots__ = ()
+    
     def validate(self):
         assert len(self.group) == 1, "EqualityCondition only works with one-cell groups (%d cells here)!" % (len(self.group),)
         
@@ -444,92 +1254,264 @@ class EqualityCondition(Condition):
     def process(self):
         self.group[0].value = self.value
         
-        log(1, self.group[0], "=", self.value)
+        if tracing.on: tracing.emit(self, 1, self.group[0], "=", self.value)
         
         self.group.detach()
     
     def symbol(self):
         return str(self.value)
 
-class SumCondition(Condition):
-    def validate(self):
-        assert len(self.group) > 1, "SumCondition only works with 2 or more cells (%d cells here)!" % (len(self.group),)
-        try:
-            s = sum(c.value for c in self.group)
-        except TypeError:
-            return False
-        return (s == self.value)
-
+class CageCondition(Condition):
+    """Arithmetic condition on the values of a cage (sum, product, ...)
+    
+    The first process() enumerates every solution of the cage. Then, each
+    value of each cell keeps a supporting solution (supports[i, v]), and
+    each value a solution without it (witnesses[v], it is not certain),
+    which are only searched for again once one of their values was removed
+    (residual supports): a cell keeps the values with a valid support, the
+    group's certain values are the ones without a valid witness.
+    
+    Subclasses give tuples(all_poss), which yields the solutions (tuples
+    of values, one per cell, one of all_poss each, without the same value
+    twice in a unique group, see conflicts()) lazily, and
+    restrict_impossible(), for the values that can never fit."""
+    __slots__ = ('supports', 'witnesses', 'pairs')
+    
+    def __init__(self, value):
+        super(CageCondition, self).__init__(value)
+        self.supports = {}
+        self.witnesses = {}
+        self.pairs = None
+    
+    def copy(self, group):
+        cond = super(CageCondition, self).copy(group)
+        cond.supports = dict(self.supports)
+        cond.witnesses = dict(self.witnesses)
+        cond.pairs = self.pairs
+        return cond
+    
+    def restrict_impossible(self):
+        pass
+    
+    def tuples(self, all_poss):
+        return iter(())
+    
     def process(self):
-        # if a value is bigger than the total sum, discard it
-        self.group.restrict(v for v in self.grid.nums if v>self.value)
+        self.restrict_impossible()
         
         if self.desintegrate():
-            log(0, "** Group", self, "was desintegrated. Done here.")
+            if tracing.on: tracing.emit(self, 0, "** Group", self, "was desintegrated. Done here.")
             return
         
-        sols = self.solve(self.value, [c.possible for c in self.group])
-        # set to only keep unique items, and tuple to be able to put them in a set
-        sols = set(tuple(s) for s in sols)
+        all_poss = [c.possible for c in self.group]
+        if not self.supports and len(all_poss) <= COMBINATIONS_MAX_CELLS:
+            # cheap enough to enumerate (bigger cages find their supports one by one)
+            possible, certain_values = self.enumerate_solutions(all_poss)
+        else:
+            possible, certain_values = self.revise(all_poss)
         
-        log(0, 'SOLUTIONS for sum =', self.value)
-        log(1, sols)
+        if tracing.on: tracing.emit(self, 1, 'certain values:', certain_values)
+        self.group.certain(certain_values)
         
-        filtered_sols = self.get_filtered_solutions(sols)
+        for c, mask in zip(self.group, possible):
+            c.possible = Domain.from_mask(c.possible.mask & mask)
         
-        if sols == filtered_sols:
-            log(1, "FILTERED SOLUTIONS did not change anything")
-            
-            self.group.info = sols
-        else:
-            log(0, 'In >', self.group.cells)
-            log(0, 'FILTERED SOLUTIONS')
-            log(1, filtered_sols)
+        self.desintegrate()
+    
+    def enumerate_solutions(self, all_poss):
+        """Every solution, to start the supports from: (possible masks, certain values)"""
+        sols = set(self.tuples(all_poss))
         
-            self.group.info = (sols, filtered_sols)
+        if tracing.on:
+            tracing.emit(self, 0, 'SOLUTIONS for', self)
+            tracing.emit(self, 1, sols)
+        
+        if self.grid.stats is not None:
+            self.grid.stats.add(self, 'enumerated', len(sols))
+        self.group.set_info(sols)
+        
+        if not sols:
+            raise Contradiction("No solution for %s" % (self.group,))
+        
+        possible = [0]*len(all_poss)
+        for sol in sols:
+            for i, v in enumerate(sol):
+                possible[i] |= 1 << v
+                self.supports[i, v] = sol
+            for v in self.grid.nums:
+                if v not in sol:
+                    self.witnesses[v] = sol
         
-            sols = filtered_sols
-
         # Values that are in every possibility of the group
         certain_values = [v for v in self.grid.nums if all(v in poss for poss in sols)]
-        log(1, 'certain values:', certain_values)
-        self.group.certain(certain_values)
+        return possible, certain_values
+    
+    def revise(self, all_poss):
+        """Check the supports, and only look for new ones when they are not valid anymore"""
+        masks = [poss.mask for poss in all_poss]
+        possible = [0]*len(masks)
+        for i, poss in enumerate(all_poss):
+            for v in poss:
+                if possible[i] >> v & 1:
+                    continue # seen in the support of another value
+                sol = self.supports.get((i, v))
+                if sol is None or not self.fits(sol, masks):
+                    fixed = list(all_poss)
+                    fixed[i] = Domain.from_mask(1 << v)
+                    sol = self.find_solution(fixed)
+                    if sol is None:
+                        continue
+                # a solution supports every value it has
+                for j, w in enumerate(sol):
+                    possible[j] |= 1 << w
+                    self.supports[j, w] = sol
+        
+        if not all(possible):
+            raise Contradiction("No solution for %s" % (self.group,))
+        
+        union = 0
+        for mask in possible:
+            union |= mask
+        certain_values = []
+        for v in Domain.from_mask(union):
+            if v in self.group.certain_values:
+                # it was certain with wider domains (certain_values is undone when searching)
+                certain_values.append(v)
+                continue
+            sol = self.witnesses.get(v)
+            if sol is None or not self.fits(sol, possible):
+                sol = self.find_solution([Domain.from_mask(mask & ~(1 << v)) for mask in possible])
+                if sol is None:
+                    certain_values.append(v)
+                    continue
+                self.witnesses[v] = sol
+        if tracing.on: tracing.emit(self, 1, 'supports checked for', self, [Domain.from_mask(m) for m in possible])
+        return possible, certain_values
+    
+    def inherit_supports(self, parent):
+        """Start from the supports of parent, whose group has this group's cells and some with a value
+        
+        Only for the cages that are too big to be enumerated (see process)."""
+        if len(self.group) <= COMBINATIONS_MAX_CELLS:
+            return
+        position = dict((c, i) for i, c in enumerate(parent.group))
+        indices = [position[c] for c in self.group]
+        fixed = [(i, c.value) for i, c in enumerate(parent.group) if c.value is not None]
+        for sol in set(parent.supports.itervalues()) | set(parent.witnesses.itervalues()):
+            if any(sol[i] != v for i, v in fixed):
+                continue
+            sol = tuple(sol[i] for i in indices)
+            for j, w in enumerate(sol):
+                self.supports[j, w] = sol
+            for v in self.grid.nums:
+                if v not in sol:
+                    self.witnesses[v] = sol
+    
+    @staticmethod
+    def fits(sol, masks):
+        for v, mask in zip(sol, masks):
+            if not mask >> v & 1:
+                return False
+        return True
+    
+    def find_solution(self, all_poss):
+        """First solution of all_poss (tuples() leaves out what unique groups forbid), None if there is none"""
+        found = next(self.tuples(all_poss), None)
+        if self.grid.stats is not None and found is not None:
+            self.grid.stats.add(self, 'enumerated', 1)
+        return found
+    
+    def rejected(self):
+        """Count a value left out because of conflicts() (when stats are on)"""
+        self.grid.stats.add(self, 'filtered')
+    
+    def conflicts(self):
+        """conflicts()[i]: (j, values mask) for the cells j < i that share a unique group with cell i
+        
+        Cells i and j can't have the same value, if it's one of mask."""
+        if self.pairs is None:
+            indices = defaultdict(list) # unique group -> indices of its cells in this group
+            for i, c in enumerate(self.group):
+                for grp in c.groups:
+                    if isinstance(grp.condition, UniqueCondition):
+                        indices[grp].append(i)
+            pairs = defaultdict(int)
+            for grp, cells in indices.iteritems():
+                mask = Domain.mask_of(grp.condition.value)
+                for n, j in enumerate(cells):
+                    for i in cells[n+1:]:
+                        pairs[i, j] |= mask
+            self.pairs = [[(j, pairs[i, j]) for j in range(i) if (i, j) in pairs]
+                            for i in range(len(self.group))]
+        return self.pairs
+    
+    def desintegrate(self):
+        if all((c.value is not None) for c in self.group):
+            self.group.detach()
+            return True
+        else:
+            return False
+
+class SumCondition(CageCondition):
+    __slots__ = ()
+    
+    def validate(self):
+        assert len(self.group) > 1, "SumCondition only works with 2 or more cells (%d cells here)!" % (len(self.group),)
+        try:
+            s = sum(c.value for c in self.group)
+        except TypeError:
+            return False
+        return (s == self.value)
+
+    def restrict_impossible(self):
+        # if a value is bigger than the total sum, discard it
+        self.group.restrict(v for v in self.grid.nums if v>self.value)
+    
+    def tuples(self, all_poss):
+        if len(all_poss) > COMBINATIONS_MAX_CELLS:
+            return self.solve(self.value, all_poss)
+        return cage_tuples("+", self.value, all_poss, self.grid.size, self.conflicts(),
+                            self.rejected if self.grid.stats is not None else None)
+    
+    def solve(self, total, all_poss):
+        """Yield every tuple of values (one per cell, in order) summing to total
         
-        for i, c in enumerate(self.group):
-            c.possible = set(s[i] for s in sols)
+        Cells are assigned in order, so each tuple comes out once. A value is
+        skipped when the cells left could not reach, or would exceed, the rest,
+        or when an earlier cell of one of its unique groups has it."""
+        all_poss = [list(poss) for poss in all_poss]
+        if not all(all_poss):
+            return iter(())
         
-        self.desintegrate()
-    
-    def solve(self, total, all_poss, level=0):
-        all_poss = [poss.copy() for poss in all_poss]
+        # low[i]/high[i]: smallest/biggest sum the cells i.. can make
         count = len(all_poss)
+        low, high = [0]*(count+1), [0]*(count+1)
+        for i in reversed(range(count)):
+            low[i] = low[i+1] + all_poss[i][0]
+            high[i] = high[i+1] + all_poss[i][-1]
         
-        if count == 0 and total == 0:
-            return [[]]
-        elif count == 0:
-            return None
-        elif any(len(poss) == 0 for poss in all_poss):
-            return None
-        
-        restricted = set(v for v in self.grid.nums if v>total)
-        for poss in all_poss:
-            poss.difference_update(restricted)
-        
-        results = []
-        #log(level, "solve(", total, count, all_poss, ")")
-        
-        for i, cell_poss in enumerate(all_poss):
-            left_poss = all_poss[:i]+all_poss[i+1:]
-            #log(level, "now cell", i, all_poss, '->', left_poss)
-            for v in cell_poss:
-                #log(level, v, "plus")
-                assert total>=v, "Oops! The value %d was not eliminated for total %d" % (v, total)
-                sols = self.solve(total-v, left_poss, level=level+1)
-                if sols is None: continue
-                for p in sols:
-                    p.insert(i, v)
-                    results.append(p)
-        return results
+        return self.solve_from(all_poss, low, high, 0, total, [])
+    
+    def solve_from(self, all_poss, low, high, i, total, placed):
+        if i == len(all_poss):
+            if total == 0:
+                yield tuple(placed)
+            return
+        conflicts = self.conflicts()[i]
+        for v in all_poss[i]:
+            left = total - v
+            if left < low[i+1]:
+                break # values are sorted, the next ones are even bigger
+            if left > high[i+1]:
+                continue
+            if any(placed[j] == v and mask >> v & 1 for j, mask in conflicts):
+                if self.grid.stats is not None:
+                    self.rejected()
+                continue
+            placed.append(v)
+            for sol in self.solve_from(all_poss, low, high, i+1, left, placed):
+                yield sol
+            placed.pop()
     
     def desintegrate(self):
         remaining_cells = []
@@ -552,6 +1534,7 @@ class SumCondition(Condition):
             grp = Group(self.grid)
             [grp.add(c) for c in remaining_cells]
             grp.set(SumCondition(remaining_total))
+            grp.condition.inherit_supports(self)
             self.grid.group_merge(grp)
             
             self.group.detach()
@@ -560,7 +1543,10 @@ class SumCondition(Condition):
     def symbol(self):
         return "%s+" % (self.value,)
 
-class ProductCondition(Condition):
+
+class ProductCondition(CageCondition):
+    __slots__ = ()
+    
     def validate(self):
         try:
             p = 1
@@ -570,77 +1556,59 @@ class ProductCondition(Condition):
             return False
         return (p == self.value)
 
-    def process(self):
+    def restrict_impossible(self):
         # if a value is bigger than the total product or is not a divisor of it, discard it
         self.group.restrict(v for v in self.grid.nums if v>self.value or \
                                                             self.value%v != 0)
+    
+    def tuples(self, all_poss):
+        if len(all_poss) > COMBINATIONS_MAX_CELLS:
+            return self.solve(self.value, all_poss)
+        return cage_tuples("*", self.value, all_poss, self.grid.size, self.conflicts(),
+                            self.rejected if self.grid.stats is not None else None)
+    
+    def solve(self, total, all_poss):
+        """Yield every tuple of values (one per cell, in order) whose product is total
         
-        if self.desintegrate():
-            log(0, "** Group", self, "was desintegrated. Done here.")
-            return
-        
-        sols = self.solve(self.value, [c.possible for c in self.group])
-        # set to only keep unique items, and tuple to be able to put them in a set
-        sols = set(tuple(s) for s in sols)
-        
-        log(0, 'SOLUTIONS for product =', self.value)
-        log(1, sols)
-        
-        filtered_sols = self.get_filtered_solutions(sols)
-        
-        if sols == filtered_sols:
-            log(1, "FILTERED SOLUTIONS did not change anything")
-            
-            self.group.info = sols
-        else:
-            log(0, 'In >', self.group.cells)
-            log(0, 'FILTERED SOLUTIONS')
-            log(1, filtered_sols)
-        
-            self.group.info = (sols, filtered_sols)
-        
-            sols = filtered_sols
-
-        # Values that are in every possibility of the group
-        certain_values = [v for v in self.grid.nums if all(v in poss for poss in sols)]
-        log(1, 'certain values:', certain_values)
-        self.group.certain(certain_values)
-        
-        for i, c in enumerate(self.group):
-            c.possible = set(s[i] for s in sols)
+        Cells are assigned in order, so each tuple comes out once. A value is
+        skipped when it does not divide the rest, when the cells left could
+        not reach, or would exceed, the rest, or when an earlier cell of one of
+        its unique groups has it."""
+        all_poss = [list(poss) for poss in all_poss]
+        if not all(all_poss):
+            return iter(())
         
-        self.desintegrate()
-    
-    def solve(self, total, all_poss, level=0):
-        all_poss = [poss.copy() for poss in all_poss]
+        # low[i]/high[i]: smallest/biggest product the cells i.. can make
         count = len(all_poss)
+        low, high = [1]*(count+1), [1]*(count+1)
+        for i in reversed(range(count)):
+            low[i] = low[i+1] * all_poss[i][0]
+            high[i] = high[i+1] * all_poss[i][-1]
         
-        if count == 0 and total == 1:
-            return [[]]
-        elif count == 0:
-            return None
-        elif any(len(poss) == 0 for poss in all_poss):
-            return None
-        
-        restricted = set(v for v in self.grid.nums if v>total or total%v != 0)
-        for poss in all_poss:
-            poss.difference_update(restricted)
-        
-        results = []
-        log(level, "solve(", total, count, all_poss, ")")
-        
-        for i, cell_poss in enumerate(all_poss):
-            left_poss = all_poss[:i]+all_poss[i+1:]
-            log(level, "now cell", i, all_poss, '->', left_poss)
-            for v in cell_poss:
-                log(level, v, "times")
-                assert total>=v and total%v == 0, "Oops! The value %d was not eliminated for total %d" % (v, total)
-                sols = self.solve(total/v, left_poss, level=level+1)
-                if sols is None: continue
-                for p in sols:
-                    p.insert(i, v)
-                    results.append(p)
-        return results
+        return self.solve_from(all_poss, low, high, 0, total, [])
+    
+    def solve_from(self, all_poss, low, high, i, total, placed):
+        if i == len(all_poss):
+            if total == 1:
+                yield tuple(placed)
+            return
+        conflicts = self.conflicts()[i]
+        for v in all_poss[i]:
+            if total % v != 0:
+                continue
+            left = total // v
+            if left < low[i+1]:
+                break # values are sorted, the next ones give even less
+            if left > high[i+1]:
+                continue
+            if any(placed[j] == v and mask >> v & 1 for j, mask in conflicts):
+                if self.grid.stats is not None:
+                    self.rejected()
+                continue
+            placed.append(v)
+            for sol in self.solve_from(all_poss, low, high, i+1, left, placed):
+                yield sol
+            placed.pop()
     
     def desintegrate(self):
         remaining_cells = []
@@ -663,6 +1631,7 @@ class ProductCondition(Condition):
             grp = Group(self.grid)
             [grp.add(c) for c in remaining_cells]
             grp.set(ProductCondition(remaining_total))
+            grp.condition.inherit_supports(self)
             self.grid.group_merge(grp)
             
             self.group.detach()
@@ -671,7 +1640,10 @@ class ProductCondition(Condition):
     def symbol(self):
         return "%sx" % (self.value,)
 
-class DivisionCondition(Condition):
+
+class DivisionCondition(CageCondition):
+    __slots__ = ()
+    
     def validate(self):
         assert len(self.group) == 2, "DivisionCondition only works with 2-cell groups (%d here)!" % (len(self.group),)
         try:
@@ -681,48 +1653,36 @@ class DivisionCondition(Condition):
             return False
         return (self.value in (div01, div10))
 
-    def process(self):
+    def restrict_impossible(self):
         # NOTE: only 2 cells! Otherwise division will be messed up!
-        
-        # Solutions are those numbers that, divided by each others, equal the desired value
-        sols = set((v1, v2) for v1 in self.grid.nums for v2 in self.grid.nums \
-                            if float(self.value) in (float(v1)/v2, float(v2)/v1))
-        
-        # all_values = set(all the values that are either in one cellor the other)
-        #            = flatten(sols) (in a set, to remove duplicates)
-        all_values = set(v for v1v2 in sols for v in v1v2)
-        
-        # Anything that is not in all values is in none of the cells!
+        # Anything that is in no solution is in none of the cells!
+        nums = [Domain(self.grid.nums)]*2
+        all_values = set(v for v1v2 in self.tuples(nums) for v in v1v2)
         self.group.restrict(v for v in self.grid.nums if v not in all_values)
-        
-        # filter solutions to fit cell possible values
-        sols = [s for s in sols if all((s[i] in self.group[i].possible) for i in range(len(s)))]
-        
-        log(0, 'SOLUTIONS', self.value, sols)
-        
-        self.group.info = sols
-        
-        # Values that are in every possibility of the group
-        certain_values = [v for v in self.grid.nums if all(v in poss for poss in sols)]
-        log(1, 'certain values:', certain_values)
-        self.group.certain(certain_values)
-        
-        for i, c in enumerate(self.group):
-            c.possible = set(s[i] for s in sols)
-        
-        self.desintegrate()
     
-    def desintegrate(self):
-        if all((c.value is not None) for c in self.group):
-            self.group.detach()
-            return True
-        else:
-            return False
+    def tuples(self, all_poss):
+        # Solutions are those numbers that, divided by each others, equal the desired value
+        # (the same value twice, for 1/, unless both cells are in a unique group)
+        same = 0
+        for j, mask in self.conflicts()[1]:
+            same |= mask
+        for v1 in all_poss[0]:
+            for v2 in all_poss[1]:
+                if v1 != v2*self.value and v2 != v1*self.value:
+                    continue
+                if v1 == v2 and same >> v1 & 1:
+                    if self.grid.stats is not None:
+                        self.rejected()
+                    continue
+                yield (v1, v2)
     
     def symbol(self):
         return "%s/" % (self.value,)
 
-class DifferenceCondition(Condition):
+
+class DifferenceCondition(CageCondition):
+    __slots__ = ()
+    
     def validate(self):
         assert len(self.group) == 2, "DifferenceCondition only works with 2-cell groups (%d here)!" % (len(self.group),)
         try:
@@ -732,84 +1692,52 @@ class DifferenceCondition(Condition):
             return False
         return (self.value in (diff01, diff10))
 
-    def process(self):
+    def restrict_impossible(self):
         # NOTE: only 2 cells! Otherwise difference will be messed up!
-        
-        # Solutions are those numbers whose difference (in either way) equals the desired value
-        sols = set((v1, v2) for v1 in self.grid.nums for v2 in self.grid.nums \
-                            if abs(v1-v2) == self.value) # v1-v2 == self.value or v2-v1 == self.value
-        
-        # all_values = set(all the values that are either in one cellor the other)
-        #            = flatten(sols) (in a set, to remove duplicates)
-        all_values = set(v for v1v2 in sols for v in v1v2)
-        
-        # Anything that is not in all values is in none of the cells!
+        # Anything that is in no solution is in none of the cells!
+        nums = [Domain(self.grid.nums)]*2
+        all_values = set(v for v1v2 in self.tuples(nums) for v in v1v2)
         self.group.restrict(v for v in self.grid.nums if v not in all_values)
-        
-        # filter solutions to fit cell possible values
-        sols = [s for s in sols if all((s[i] in self.group[i].possible) for i in range(len(s)))]
-        
-        log(0, 'SOLUTIONS', self.value, sols)
-        
-        self.group.info = sols
-        
-        # Values that are in every possibility of the group
-        certain_values = [v for v in self.grid.nums if all(v in poss for poss in sols)]
-        log(1, 'certain values:', certain_values)
-        self.group.certain(certain_values)
-                
-        for i, c in enumerate(self.group):
-            c.possible = set(s[i] for s in sols)
-        
-        self.desintegrate()
     
-    def desintegrate(self):
-        if all((c.value is not None) for c in self.group):
-            self.group.detach()
-            return True
-        else:
-            return False
+    def tuples(self, all_poss):
+        # Solutions are those numbers whose difference (in either way) equals the desired value
+        for v1 in all_poss[0]:
+            for v2 in all_poss[1]:
+                if abs(v1-v2) == self.value:
+                    yield (v1, v2)
     
     def symbol(self):
         return "%s-" % (self.value,)
 
-if __name__ == "__main__":
-    DO_LOG = (raw_input("DO_LOG?(Y/N)").lower()[:1] == "y")
-    
-    from grids import all_grids
-    
-    print "Grids:"
-    for name in all_grids:
-        print "-", name
 
-    possible_names = []
-    while len(possible_names) != 1:
-        name_start = raw_input("Which one?")
-        if name_start in all_grids:
-            possible_names = [name_start]
-            break
-        possible_names = [n for n in all_grids if n.startswith(name_start)]
-    name = possible_names[0]
-    
-    size, info = all_grids[name]
-    
-    conds = {"=": EqualityCondition,
+CONDITIONS = {"=": EqualityCondition,
                 "+": SumCondition, "-": DifferenceCondition,
                 "*": ProductCondition, "/": DivisionCondition,
                 "u": lambda v: UniqueCondition}
+
+def make_grid(size, info):
+    """Build and set up a grid from its definition (as in grids.py)
     
+    The givens of a sudoku (one cell "=" blocks) are not groups: they are
+    the possible values of their cells from the start."""
     g = Grid(size)
     
     for i in info:
-        if size == "sudoku":
+        v, op = int(i[0][:-1]), i[0][-1]
+        if g.sudoku and op == "=" and len(i) == 2 and 0 < v <= g.size:
+            c = g.at(*i[1])
+            if c.value is None:
+                c.possible = [v]
+                continue
+        
+        if g.sudoku:
             blk = Group(g)
         else:
             blk = Block(g)
-        v, op = int(i[0][:-1]), i[0][-1]
         
-        try: Cond = conds[op]
+        try: Cond = CONDITIONS[op]
         except KeyError:
-            log("0", "#", "Unknown Condition!", op, "value", v)
+            if tracing.on: tracing.emit("make_grid", 0, "#", "Unknown Condition!", op, "value", v)
             continue
         else: cond = Cond(v)
         blk.set(cond)
@@ -817,6 +1745,42 @@ if __name__ == "__main__":
         [blk.add(g.at(*cpos)) for cpos in i[1:]]
     
     g.setup()
+    return g
+
+if __name__ == "__main__":
+    if raw_input("Trace?(Y/N)").lower()[:1] == "y":
+        tracing.enable(tracing.StdoutSink())
+    
+    import library
+    grids = library.default()
+    
+    def show_names(names, shown=30):
+        """Print the first names only (the library can be big)"""
+        names = list(itertools.islice(names, shown+1))
+        for name in names[:shown]:
+            print "-", name
+        if len(names) > shown:
+            print "- ..."
+    
+    print "Grids:"
+    show_names(grids.names())
+
+    possible_names = []
+    while len(possible_names) != 1:
+        name_start = raw_input("Which one?")
+        if name_start in grids:
+            possible_names = [name_start]
+            break
+        possible_names = list(itertools.islice(grids.names(name_start), 2))
+        if len(possible_names) > 1:
+            show_names(grids.names(name_start))
+    name = possible_names[0]
+    
+    size, info = grids[name]
+    
+    g = make_grid(size, info)
+    g.keep_removed_groups = True
+    g.keep_info = True
     
     g.display(False)
     
@@ -825,6 +1789,7 @@ if __name__ == "__main__":
     def run():
         g.process()
         g.display()
+        return True
     
     def opt_groups(enum=True):
         if enum:
@@ -842,7 +1807,7 @@ if __name__ == "__main__":
             except:
                 return
         if index < len(g.groups):
-            grp = g.groups[index]
+            grp = list(g.groups)[index]
         else:
             grp = g.removed_groups[index-len(g.groups)]
         
@@ -872,6 +1837,14 @@ if __name__ == "__main__":
         again = (raw_input("Antoher?(Y/N)").upper()[:1] == "Y")
         return opt_cells(enum=False) if again else True
     
+    def opt_solve():
+        if g.solve() is None:
+            print "No solution! :("
+        else:
+            g.display()
+        print "Nodes:", g.search_stats['nodes'], "Backtracks:", g.search_stats['backtracks']
+        return True
+    
     def opt_validate():
         if g.validate():
             print "Valid Grid!"
@@ -879,15 +1852,15 @@ if __name__ == "__main__":
             print "Invalid Grid! :("
         return True
     
+    # process() runs until nothing changes anymore, once is enough
+    run()
+    
     its_ok = True
     while its_ok:
-        do_run = (raw_input("Run again?(Y/N)").upper()[:1] == "Y")
-        if do_run:
-            run()
-            continue
-        
         print "Options:"
         options = { "q": ("Quit", lambda: False),
+                    "r": ("Run again", run),
+                    "s": ("Solve (guess when stuck)", opt_solve),
                     "g": ("List Groups", opt_groups),
                     "c": ("List cells", opt_cells),
                     "v": ("Validate grid", opt_validate)
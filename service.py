@@ -0,0 +1,381 @@
+"""Local solver service
+
+    python service.py [options]
+
+Keeps a pool of worker processes running, and solves the puzzles POSTed to
+http://127.0.0.1:8642/solve (it only listens on the local machine by
+default). The body is either JSON:
+
+    {"name": "first", "size": 4, "info": [["8+", [0, 0], [0, 1], [1, 1]], ...]}
+
+(or a list of such objects), or text in the grids.py or the line format
+(see formats.py). The answer is one JSON object per puzzle (a list if
+several puzzles were sent):
+
+    {"name": "first", "status": "solved", "seconds": 0.01, "nodes": 3,
+     "backtracks": 0, "values": [1, 2, ...], "cached": false}
+
+status is solved, unsolvable or error (with an "error" message instead of
+the values). GET /stats returns the counters of the service. When the
+answers aren't there after --timeout seconds, the answer is a 504 error
+(and the service stops waiting for them).
+
+Puzzles are queued, and sent to the workers as soon as one of them is
+free: when they are all busy, the queue fills up and the next puzzles
+go in batches (of --batch-size puzzles at most), one message to a worker
+for many puzzles. Results are kept in an LRU cache, by canonical form
+(see canonical.py): a puzzle that was already solved, whatever its name,
+the order of its blocks, or if it was rotated, reflected or (sudokus) had
+its digits relabeled, is answered at once, and a puzzle that is being
+solved is not solved a second time.
+
+loadtest.py sends puzzles to a running service and measures it.
+"""
+from collections import OrderedDict
+from Queue import Queue, Empty
+import BaseHTTPServer
+import SocketServer
+import StringIO
+import json
+import multiprocessing
+import optparse
+import sys
+import threading
+import time
+
+import batch
+import canonical
+import formats
+import main
+
+def init_worker(combinations_file, warm_sizes):
+    """Load the combination tables, and build those of warm_sizes"""
+    batch.init_worker(combinations_file)
+    for size in warm_sizes:
+        for op in main.COMBINATIONS_OPS:
+            for count in range(2, main.COMBINATIONS_MAX_CELLS+1):
+                main.combinations(op, 0, count, size)
+
+def solve_batch(puzzles, sudoku_engine="search"):
+    """Results of batch.solve_puzzle for a list of puzzles, in a worker"""
+    return [batch.solve_puzzle(puzzle, False, sudoku_engine) for puzzle in puzzles]
+
+def result_dict(result):
+    """JSON-able result (without the name) of a batch.solve_puzzle result"""
+    name, status, seconds, nodes, backtracks, values, solve_stats = result
+    answer = {'status': status, 'seconds': seconds, 'nodes': nodes, 'backtracks': backtracks}
+    if status == 'error':
+        answer['error'] = values
+    else:
+        answer['values'] = values
+    return answer
+
+class LRUCache(object):
+    """Mapping that forgets its least recently used entries past max_size"""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries[key] = value # most recently used is last
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+class Batch(object):
+    """Puzzles sent to a worker at once: (key, transform to the canonical values) of each
+
+    It holds a slot of the service until it is done: solved, or given up
+    because one of its puzzles timed out (see Service.abandon)."""
+    def __init__(self, items):
+        self.items = items
+        self.done = False
+
+class Ticket(object):
+    """Result of a submitted puzzle, once it is there
+
+    Answers are shared by equivalent puzzles, with the values of the
+    canonical grid: transform (a canonical.Transform) maps them back."""
+    def __init__(self, name, key, transform):
+        self.name = name
+        self.key = key
+        self.transform = transform
+        self.event = threading.Event()
+        self.answer = None
+        self.cached = False
+
+    def set(self, answer, cached=False):
+        self.answer = answer
+        self.cached = cached
+        self.event.set()
+
+    def result(self, timeout=None):
+        """The answer (as in the module docstring), None if timeout seconds went by"""
+        if not self.event.wait(timeout):
+            return None
+        answer = dict(self.answer, name=self.name, cached=self.cached)
+        if answer.get('values') is not None:
+            answer['values'] = self.transform.from_canonical(answer['values'])
+        return answer
+
+class Service(object):
+    """Worker pool, batching and cache: submit() puzzles from any thread"""
+    def __init__(self, processes=None, batch_size=8, cache_size=10000,
+                    combinations_file=None, sudoku_engine="search", warm_sizes=(), timeout=60):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self.timeout = timeout
+        # two batches per worker: the next one is there when it is done with one
+        self.slots = threading.Semaphore(2*self.processes)
+        self.sudoku_engine = sudoku_engine
+        self.pool = multiprocessing.Pool(self.processes, init_worker,
+                                            (combinations_file, list(warm_sizes)))
+        self.cache = LRUCache(cache_size)
+        self.lock = threading.Lock()
+        self.waiting = {} # key -> tickets of the puzzle being solved
+        self.running = {} # key -> batch it was sent in
+        self.queue = Queue()
+        self.counters = {'requests': 0, 'joined': 0, 'batches': 0, 'solved': 0, 'errors': 0,
+                            'timeouts': 0}
+        self.dispatcher = threading.Thread(target=self.dispatch)
+        self.dispatcher.daemon = True
+        self.dispatcher.start()
+
+    def submit(self, puzzle):
+        """Ticket for the result of a (name, size, info) puzzle"""
+        name, size, info = puzzle
+        key, transform = canonical.canonical_key(size, info)
+        ticket = Ticket(name, key, transform)
+        with self.lock:
+            self.counters['requests'] += 1
+            answer = self.cache.get(key)
+            if answer is not None:
+                ticket.set(answer, cached=True)
+            elif key in self.waiting:
+                self.counters['joined'] += 1
+                self.waiting[key].append(ticket)
+            else:
+                self.waiting[key] = [ticket]
+                self.queue.put((key, puzzle, transform))
+        return ticket
+
+    def wait(self, tickets):
+        """Answers of tickets, None for those that aren't there after self.timeout seconds
+
+        The service stops waiting for those (see abandon)."""
+        deadline = time.time() + self.timeout
+        answers = []
+        try:
+            for ticket in tickets:
+                answers.append(ticket.result(max(0, deadline - time.time())))
+        finally:
+            for ticket in tickets:
+                if not ticket.event.is_set():
+                    self.abandon(ticket)
+        return answers
+
+    def solve(self, puzzle):
+        return self.wait([self.submit(puzzle)])[0]
+
+    def abandon(self, ticket):
+        """Stop waiting for the puzzle of ticket: its tickets get an error
+
+        Its batch (if it was sent) frees its slot, in case the worker
+        died or lost it: results that come afterwards are still handed to
+        the tickets waiting for them, if any."""
+        answer = {'status': 'error', 'error': "timed out", 'seconds': self.timeout,
+                    'nodes': 0, 'backtracks': 0}
+        with self.lock:
+            if ticket.event.is_set():
+                return # answered in the meantime
+            self.counters['timeouts'] += 1
+            for waiting in self.waiting.pop(ticket.key, []):
+                waiting.set(answer)
+            batch = self.running.pop(ticket.key, None)
+            if batch is not None:
+                self.end(batch)
+
+    def end(self, batch):
+        """Free the slot of a batch, once (with self.lock)"""
+        if not batch.done:
+            batch.done = True
+            self.slots.release()
+
+    def dispatch(self):
+        """Send the queued puzzles to the pool, batch_size at most at once"""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            # puzzles queued while waiting for a free worker go with this one
+            self.slots.acquire()
+            items = [item]
+            while len(items) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except Empty:
+                    break
+                if item is None:
+                    self.queue.put(None) # stop once this batch is sent
+                    break
+                items.append(item)
+
+            with self.lock:
+                # puzzles given up while they were queued are not sent
+                items = [item for item in items if item[0] in self.waiting]
+                if not items:
+                    self.slots.release()
+                    continue
+                batch = Batch([(key, transform) for key, puzzle, transform in items])
+                for key, transform in batch.items:
+                    self.running[key] = batch
+                self.counters['batches'] += 1
+            self.pool.apply_async(solve_batch, ([puzzle for key, puzzle, transform in items], self.sudoku_engine),
+                                    callback=lambda results, batch=batch: self.finish(batch, results))
+
+    def finish(self, batch, results):
+        """Cache the results of a batch, and hand them to the waiting tickets"""
+        with self.lock:
+            try:
+                for (key, transform), result in zip(batch.items, results):
+                    if self.running.get(key) is batch:
+                        del self.running[key]
+                    answer = result_dict(result)
+                    if answer.get('values') is not None:
+                        # transform is the one of the puzzle that was solved
+                        answer['values'] = transform.to_canonical(answer['values'])
+                    if answer['status'] == 'error':
+                        self.counters['errors'] += 1
+                    else:
+                        self.counters['solved'] += 1
+                        self.cache.put(key, answer)
+                    for ticket in self.waiting.pop(key, []):
+                        ticket.set(answer)
+            finally:
+                self.end(batch)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, processes=self.processes, cached=len(self.cache),
+                        cache_hits=self.cache.hits, cache_misses=self.cache.misses,
+                        queued=self.queue.qsize(), solving=len(self.waiting))
+
+    def close(self):
+        self.queue.put(None)
+        self.dispatcher.join()
+        self.pool.close()
+        self.pool.join()
+
+def read_request(body):
+    """Puzzles of a request body, and whether a single puzzle was sent (JSON or text)"""
+    if body.lstrip()[:1] in ('{', '['):
+        data = json.loads(body)
+        single = isinstance(data, dict)
+        puzzles = []
+        for item in ([data] if single else data):
+            size = item['size']
+            if not main.is_sudoku(size):
+                size = int(size)
+            info = [[blk[0]] + [tuple(cpos) for cpos in blk[1:]] for blk in item['info']]
+            puzzles.append((item.get('name', ''), size, info))
+        return puzzles, single
+    return list(formats.read(StringIO.StringIO(body))), False
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    verbose = False
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.reply(200, self.server.service.stats())
+        else:
+            self.reply(404, {'error': 'not found: %s' % (self.path,)})
+
+    def do_POST(self):
+        if self.path != '/solve':
+            self.reply(404, {'error': 'not found: %s' % (self.path,)})
+            return
+        body = self.rfile.read(int(self.headers.getheader('content-length', 0)))
+        try:
+            puzzles, single = read_request(body)
+            tickets = [self.server.service.submit(puzzle) for puzzle in puzzles]
+        except (ValueError, KeyError, TypeError, IndexError, SyntaxError) as e:
+            self.reply(400, {'error': "%s: %s" % (e.__class__.__name__, e)})
+            return
+        answers = self.server.service.wait(tickets)
+        if None in answers:
+            self.reply(504, {'error': 'no answer after %g seconds' % (self.server.service.timeout,)})
+            return
+        self.reply(200, answers[0] if single else answers)
+
+    def reply(self, code, data):
+        body = json.dumps(data)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, service):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.service = service
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--host", default="127.0.0.1",
+                        help="address to listen on (default: 127.0.0.1, only this machine)")
+    parser.add_option("-p", "--port", type="int", default=8642, help="port (default: 8642)")
+    parser.add_option("-j", "--processes", type="int", default=None,
+                        help="number of worker processes (default: one per core)")
+    parser.add_option("-b", "--batch-size", type="int", default=8,
+                        help="most puzzles sent to a worker at once (default: 8)")
+    parser.add_option("--cache", type="int", default=10000,
+                        help="results kept in the cache, 0 for none (default: 10000)")
+    parser.add_option("-c", "--combinations", default=None,
+                        help="combination tables file (see main.save_combinations)")
+    parser.add_option("-e", "--sudoku-engine", choices=["search", "dlx"], default="search",
+                        help="how sudokus are solved: search (default) or dlx (exact cover)")
+    parser.add_option("-t", "--timeout", type="float", default=60,
+                        help="seconds before giving up on the answers of a request (default: 60)")
+    parser.add_option("-v", "--verbose", action="store_true", default=False,
+                        help="log every request")
+    options, args = parser.parse_args()
+
+    Handler.verbose = options.verbose
+    service = Service(options.processes, options.batch_size, options.cache, options.combinations, options.sudoku_engine,
+                        warm_sizes=range(3, 10), timeout=options.timeout)
+    server = Server((options.host, options.port), service)
+    print >>sys.stderr, "Solving on http://%s:%d/solve with %d processes" % (
+                        options.host, options.port, service.processes)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
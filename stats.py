@@ -0,0 +1,55 @@
+"""Where the solving time goes
+
+Counting is off by default. Give a grid a Stats object to turn it on:
+
+    g.stats = Stats()
+    g.solve()
+    print g.stats.as_dict()     # or g.stats.dump("stats.json")
+
+Counters are kept per condition class ("SumCondition", ...):
+ calls        times its process() ran
+ time         seconds spent in it
+ enumerated   candidate tuples its solve() (or the combination tables) found
+ filtered     values left out while enumerating them, because an earlier
+              cell of the same unique group had that value
+ spawned      groups created by its desintegrate()
+ detached     groups of that class that were detached
+and per cell, the number of possible values that were eliminated.
+"""
+from collections import defaultdict
+import json
+
+COUNTERS = ('calls', 'time', 'enumerated', 'filtered', 'spawned', 'detached')
+
+class Stats(object):
+    def __init__(self):
+        self.conditions = {}
+        self.eliminations = defaultdict(int) # (x, y) -> count
+        self.process_calls = 0
+        self.process_time = 0.0
+        self.search = {}
+
+    def condition(self, cond):
+        """Counters of the class of cond (a condition, or its class name)"""
+        name = cond if isinstance(cond, basestring) else cond.__class__.__name__
+        try:
+            return self.conditions[name]
+        except KeyError:
+            counters = self.conditions[name] = dict.fromkeys(COUNTERS, 0)
+            counters['time'] = 0.0
+            return counters
+
+    def add(self, cond, counter, n=1):
+        self.condition(cond)[counter] += n
+
+    def as_dict(self):
+        return {
+            'process': {'calls': self.process_calls, 'time': self.process_time},
+            'conditions': self.conditions,
+            'eliminations': dict(("%d,%d" % pos, n) for pos, n in self.eliminations.iteritems()),
+            'search': self.search,
+        }
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=1, sort_keys=True)
@@ -0,0 +1,121 @@
+"""What the solver is doing, when asked
+
+Call sites check tracing.on themselves, so that nothing (not even the
+arguments) is evaluated when tracing is off:
+
+    if tracing.on: tracing.emit(self, 1, "certain values:", certain_values)
+
+An event has a category (a string, or an object whose class name is used,
+e.g. "SumCondition"), a level (0 for the main steps, higher for details,
+it is also the indentation) and arguments, joined with spaces.
+
+    tracing.enable(StdoutSink(), level=1, categories=["SumCondition"])
+
+Sinks are objects with a write(time, category, level, message) method:
+StdoutSink prints, RingBuffer keeps the last events in memory, and
+BinaryFile writes a compact file that read_binary reads back.
+"""
+from collections import deque
+import struct
+import time
+
+on = False
+sinks = []
+max_level = None
+categories = None
+
+def enable(*new_sinks, **options):
+    """Send events to new_sinks (as well as the current ones)
+
+    Options: level (only events up to this level, default: all) and
+    categories (only events of these categories, default: all)."""
+    global on, max_level, categories
+    sinks.extend(new_sinks)
+    max_level = options.get('level')
+    cats = options.get('categories')
+    categories = set(cats) if cats is not None else None
+    on = len(sinks) > 0
+
+def disable():
+    global on
+    on = False
+    for sink in sinks:
+        if hasattr(sink, 'close'):
+            sink.close()
+    del sinks[:]
+
+def emit(category, level, *args):
+    if not isinstance(category, basestring):
+        category = category.__class__.__name__
+    if max_level is not None and level > max_level:
+        return
+    if categories is not None and category not in categories:
+        return
+    # formatted now: the arguments (sets, cells) may change afterwards
+    message = " ".join(str(a) for a in args)
+    t = time.time()
+    for sink in sinks:
+        sink.write(t, category, level, message)
+
+def format_event(t, category, level, message):
+    return "%s %s" % ("  "*level, message)
+
+class StdoutSink(object):
+    def write(self, t, category, level, message):
+        print format_event(t, category, level, message)
+
+class RingBuffer(object):
+    """The last size events (time, category, level, message)"""
+    def __init__(self, size=10000):
+        self.events = deque(maxlen=size)
+
+    def write(self, t, category, level, message):
+        self.events.append((t, category, level, message))
+
+    def lines(self):
+        return [format_event(*event) for event in self.events]
+
+# Binary trace file: MAGIC, then records, each starting with its type:
+#   'C' category id (H), name length (H), name: defines a category id
+#   'E' time (d), category id (H), level (B), message length (I), message
+MAGIC = "DOKUTRC1"
+CATEGORY = struct.Struct("<cHH")
+EVENT = struct.Struct("<cdHBI")
+
+class BinaryFile(object):
+    def __init__(self, path):
+        self.f = open(path, 'wb')
+        self.f.write(MAGIC)
+        self.category_ids = {}
+
+    def write(self, t, category, level, message):
+        try:
+            cat_id = self.category_ids[category]
+        except KeyError:
+            cat_id = self.category_ids[category] = len(self.category_ids)
+            name = category.encode('utf-8')
+            self.f.write(CATEGORY.pack('C', cat_id, len(name)) + name)
+        message = message.encode('utf-8')
+        self.f.write(EVENT.pack('E', t, cat_id, min(level, 255), len(message)) + message)
+
+    def close(self):
+        self.f.close()
+
+def read_binary(path):
+    """Yield the (time, category, level, message) events of a BinaryFile"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a trace file" % (path,))
+        names = {}
+        while True:
+            kind = f.read(1)
+            if not kind:
+                break
+            if kind == 'C':
+                _, cat_id, length = CATEGORY.unpack(kind + f.read(CATEGORY.size-1))
+                names[cat_id] = f.read(length).decode('utf-8')
+            elif kind == 'E':
+                _, t, cat_id, level, length = EVENT.unpack(kind + f.read(EVENT.size-1))
+                yield t, names[cat_id], level, f.read(length).decode('utf-8')
+            else:
+                raise ValueError("Unknown record %r in %s" % (kind, path))
@@ -1,8 +1,8 @@
 from PyQt4 import QtGui, QtCore
+from itertools import islice
 import sys
-from main import EqualityCondition, SumCondition, ProductCondition, UniqueCondition, \
-        DifferenceCondition, DivisionCondition, Grid, Block, Group
-from grids import all_grids
+from main import make_grid
+import library
 
 class MainWindow(QtGui.QWidget):
     
@@ -20,14 +20,13 @@ class MainWindow(QtGui.QWidget):
                 text.setText(str(cell.value))
             else:
                 text.setText("")
-            text.setInputMask("D")
+            text.setInputMask("D" if self.grid.size < 10 else "D0")
             
             if self.grid.sudoku:
-                try:
-                    cond = (g.condition for g in cell.groups if isinstance(g.condition, EqualityCondition)).next()
-                    text.setPlaceholderText(cond.symbol())
-                    text.setText(str(cond.value))
-                except StopIteration:
+                if (x, y) in self.givens:
+                    text.setPlaceholderText(str(self.givens[x, y]))
+                    text.setText(str(self.givens[x, y]))
+                else:
                     text.setPlaceholderText("")
             else:
                 text.setPlaceholderText(cell.block.condition.symbol())
@@ -91,36 +90,11 @@ class MainWindow(QtGui.QWidget):
         
     
     def load(self, name):
-        
-        size, info = all_grids[name]
-    
-        conds = {"=": EqualityCondition,
-                    "+": SumCondition, "-": DifferenceCondition,
-                    "*": ProductCondition, "/": DivisionCondition,
-                    "u": lambda v: UniqueCondition}
-        
-        g = Grid(size)
-    
-        for i in info:
-            if size == "sudoku":
-                blk = Group(g)
-            else:
-                blk = Block(g)
-            v, op = int(i[0][:-1]), i[0][-1]
-            
-            try:
-                Cond = conds[op]
-            except KeyError:
-                log("0", "#", "Unknown Condition!", op, "value", v)
-                continue
-            else:
-                cond = Cond(v)
-            blk.set(cond)
-            
-            [blk.add(g.at(*cpos)) for cpos in i[1:]]
-    
-        g.setup()
-        self.grid = g
+        size, info = library.default()[name]
+        self.grid = make_grid(size, info)
+        # make_grid turns the givens of sudokus into cell domains, not groups
+        self.givens = dict((tuple(blk[1]), int(blk[0][:-1])) for blk in info
+                            if len(blk) == 2 and blk[0][-1:] == "=")
     
     def updateGrid(self):
         for (x, y), cell in self.grid.cells.iteritems():
@@ -188,12 +162,12 @@ class SelectDialog(QtGui.QDialog):
         
         self.populate()
     
+    # names listed at most (type more of the name to see the others)
+    shown = 500
+    
     def populate(self, text=None):
         self.list.clear()
-        if text:
-            self.items = [name for name in all_grids if text in name]
-        else:
-            self.items = all_grids.keys()
+        self.items = list(islice(library.default().search(text or ""), self.shown))
         self.list.addItems(self.items)
         self.list.setSelectionMode(QtGui.QListWidget.SingleSelection)
         self.list.setCurrentRow(0)